@@ -7,20 +7,35 @@ import logging
 import time
 import socket
 import json
-from pathlib import Path
-from collections import defaultdict
+from collections import deque
 import dpkt
 import zmq
 import threading
-import os
 import uuid
 
+try:
+    import msgpack  # optional: compact binary ZMQ meta (--meta-format msgpack)
+except ImportError:
+    msgpack = None
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Debug progress is logged every 128 RTP packets (power of two so the check is a mask, not a modulo)
+PROGRESS_LOG_MASK = 127
+
+# Precompiled big-endian header fields, read in place with unpack_from (no slice copies per packet)
+RTP_SEQ_TS_SSRC = struct.Struct('!HII')  # sequence, timestamp, SSRC at offset 2
+U16_BE = struct.Struct('!H')
+U32_BE = struct.Struct('!I')
+
 class ProcessMonitor:
     """Monitor tcpdump process and restart it if it crashes"""
+
+    # Restart delay doubles while tcpdump keeps dying right away (no CAP_NET_RAW, bad filter, interface gone)
+    RESTART_BACKOFF_MIN_SEC = 1.0
+    RESTART_BACKOFF_MAX_SEC = 30.0
     
     def __init__(self, recovery_instance):
         self.recovery = recovery_instance
@@ -28,29 +43,43 @@ class ProcessMonitor:
         self.monitor_thread = None
         self.running = False
         self.process_restarted = False # Flag to indicate if the process was restarted
+        self._stop_event = threading.Event()  # wakes the backoff sleep on stop()
         
     def start_monitoring(self, process):
         """Start monitoring the tcpdump process"""
         self.tcpdump_process = process
         self.running = True
+        self._stop_event.clear()
         self.monitor_thread = threading.Thread(target=self._monitor_process, daemon=True)
         self.monitor_thread.start()
         
     def _monitor_process(self):
         """Monitor the tcpdump process and restart if it crashes"""
-        while self.running:
-            if self.tcpdump_process and self.tcpdump_process.poll() is not None:
-                # Process has exited
-                exit_code = self.tcpdump_process.poll()
-                logger.warning(f"tcpdump process (PID: {self.tcpdump_process.pid}) exited with code {exit_code}, restarting...")
-                
-                # Set flag to indicate process restart
-                self.process_restarted = True
-                
-                # Restart tcpdump
+        delay = self.RESTART_BACKOFF_MIN_SEC
+        started_at = time.monotonic()
+        while self.running and self.tcpdump_process:
+            # Block until the process exits instead of polling every second
+            exit_code = self.tcpdump_process.wait()
+            if not self.running:
+                break
+            # A process that ran for a while is a fresh failure; only back off on repeated quick exits
+            if time.monotonic() - started_at > self.RESTART_BACKOFF_MAX_SEC:
+                delay = self.RESTART_BACKOFF_MIN_SEC
+            logger.warning(f"tcpdump process (PID: {self.tcpdump_process.pid}) exited with code {exit_code}, restarting in {delay:.0f}s...")
+            
+            # Set flag to indicate process restart
+            self.process_restarted = True
+            
+            if self._stop_event.wait(delay):
+                break
+            delay = min(delay * 2, self.RESTART_BACKOFF_MAX_SEC)
+            
+            # Restart tcpdump; on failure the old (exited) process stays current and the next wait() returns at once
+            try:
                 self._restart_tcpdump()
-                
-            time.sleep(1)  # Check every second
+            except Exception as e:
+                logger.error(f"Failed to restart tcpdump: {e}")
+            started_at = time.monotonic()
             
     def _restart_tcpdump(self):
         """Restart the tcpdump process"""
@@ -83,17 +112,19 @@ class ProcessMonitor:
     def stop(self):
         """Stop monitoring and clean up"""
         self.running = False
-        if self.monitor_thread:
-            self.monitor_thread.join(timeout=2)
+        self._stop_event.set()
+        # Terminate first so the monitor thread's blocking wait() returns
         if self.tcpdump_process:
             try:
                 self.tcpdump_process.terminate()
                 self.tcpdump_process.wait(timeout=5)
             except:
                 pass
+        if self.monitor_thread:
+            self.monitor_thread.join(timeout=2)
 
 class SenderAudioRecovery:
-    def __init__(self, zmq_endpoint="tcp://100.120.241.10:5556", chunk_seconds=2.0):
+    def __init__(self, zmq_endpoint="tcp://100.120.241.10:5556", chunk_seconds=2.0, meta_format="json"):
         self.hotline_server_ip = "192.168.0.201"
         self.blacklisted_ips = {"192.168.0.118", "192.168.0.119", "192.168.0.121"}
         
@@ -104,6 +135,12 @@ class SenderAudioRecovery:
         self.channels = 1
         self.chunk_bytes = int(self.sample_rate * self.sample_width_bytes * self.chunk_seconds)
         
+        # Chunk meta encoding; the daemon detects either format per message
+        if meta_format == "msgpack" and msgpack is None:
+            logger.warning("msgpack not installed, falling back to JSON chunk meta")
+            meta_format = "json"
+        self.meta_format = meta_format
+        
         # ZMQ setup
         self.zmq_ctx = zmq.Context()
         self.zmq_sock = self.zmq_ctx.socket(zmq.PUSH)
@@ -118,7 +155,7 @@ class SenderAudioRecovery:
         # Process monitor
         self.process_monitor = ProcessMonitor(self)
         
-        logger.info(f"Sender audio recovery initialized - chunk: {self.chunk_seconds}s, bytes: {self.chunk_bytes}")
+        logger.info(f"Sender audio recovery initialized - chunk: {self.chunk_seconds}s, bytes: {self.chunk_bytes}, meta: {self.meta_format}")
 
     def is_ip_blacklisted(self, ip):
         """Check if IP is blacklisted"""
@@ -167,18 +204,16 @@ class SenderAudioRecovery:
             marker = (byte1 >> 7) & 0x1
             payload_type = byte1 & 0x7F
             
-            if version != 2 or payload_type not in [0, 8]:
+            if version != 2 or payload_type not in (0, 8):
                 return None
                 
-            sequence = struct.unpack('!H', payload_bytes[2:4])[0]
-            timestamp = struct.unpack('!I', payload_bytes[4:8])[0]
-            ssrc = struct.unpack('!I', payload_bytes[8:12])[0]
+            sequence, timestamp, ssrc = RTP_SEQ_TS_SSRC.unpack_from(payload_bytes, 2)
             
             header_length = 12 + cc * 4
             if extension:
                 if len(payload_bytes) < header_length + 4:
                     return None
-                ext_length = struct.unpack('!H', payload_bytes[header_length + 2:header_length + 4])[0]
+                ext_length = U16_BE.unpack_from(payload_bytes, header_length + 2)[0]
                 header_length += 4 + ext_length * 4
             
             if len(payload_bytes) <= header_length:
@@ -199,7 +234,7 @@ class SenderAudioRecovery:
                 'codec': codec
             }
         except Exception as e:
-            logger.debug(f"RTP parsing error: {e}")
+            logger.debug("RTP parsing error: %s", e)
             return None
 
     def parse_rtcp_packet(self, payload_bytes):
@@ -222,7 +257,7 @@ class SenderAudioRecovery:
                 rc = byte0 & 0x1F
                 
                 packet_type = payload_bytes[offset + 1]
-                length = struct.unpack('!H', payload_bytes[offset + 2:offset + 4])[0]
+                length = U16_BE.unpack_from(payload_bytes, offset + 2)[0]
                 packet_length = (length + 1) * 4
                 
                 if version != 2 or packet_length == 0:
@@ -230,7 +265,7 @@ class SenderAudioRecovery:
                 
                 # Detect BYE packet (Packet Type 203)
                 if packet_type == 203 and offset + 8 <= len(payload_bytes):
-                    ssrc = struct.unpack('!I', payload_bytes[offset + 4:offset + 8])[0]
+                    ssrc = U32_BE.unpack_from(payload_bytes, offset + 4)[0]
                     bye_ssrcs.append(ssrc)
                     logger.info(f"Detected RTCP BYE: SSRC {ssrc:08x}")
                 
@@ -241,7 +276,7 @@ class SenderAudioRecovery:
             return bye_ssrcs if bye_ssrcs else None
             
         except Exception as e:
-            logger.debug(f"RTCP parsing error: {e}")
+            logger.debug("RTCP parsing error: %s", e)
             return None
 
     def create_or_update_session(self, ssrc, src_ip, dst_ip, src_port, dst_port, direction, codec):
@@ -348,19 +383,24 @@ class SenderAudioRecovery:
         
         try:
             # Calculate current message size
-            meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+            if self.meta_format == "msgpack":
+                meta_bytes = msgpack.packb(meta, use_bin_type=True)
+            else:
+                meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
             
-            # Use non-blocking send, drop old data when queue is full
+            # Use non-blocking send, drop old data when queue is full.
+            # copy=False lets libzmq reference the joined chunk instead of copying it into a new message
+            # (pyzmq still copies frames under zmq.COPY_THRESHOLD, where a copy is cheaper than tracking).
             self.zmq_sock.send_multipart([
                 meta_bytes,
                 pcm_bytes
-            ], zmq.NOBLOCK)
+            ], zmq.NOBLOCK, copy=False)
             
-            logger.debug(f"Published ZMQ chunk: {len(pcm_bytes)} bytes, source: {source}")
+            logger.debug("Published ZMQ chunk: %d bytes, source: %s", len(pcm_bytes), source)
             
         except zmq.Again:
             # Queue is full, message dropped
-            logger.warning(f"ZMQ queue full, message dropped: peer_ip={peer_ip}, source={source}, size={len(pcm_bytes)} bytes")
+            logger.warning("ZMQ queue full, message dropped: peer_ip=%s, source=%s, size=%d bytes", peer_ip, source, len(pcm_bytes))
         except Exception as e:
             logger.error(f"ZMQ send failed: {e}")
 
@@ -382,7 +422,8 @@ class SenderAudioRecovery:
         
         try:
             processed_packets = 0
-            last_activity_time = time.time()
+            # Log level is fixed once the stream starts; avoid building per-packet debug strings when disabled
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
             
             logger.info("Started continuous data stream monitoring...")
             
@@ -392,13 +433,17 @@ class SenderAudioRecovery:
                 current_process = self.process_monitor.tcpdump_process
                 
                 # Debug: log current process state
-                logger.debug(f"Current process PID: {current_process.pid if current_process else 'None'}, status: {current_process.poll() if current_process else 'N/A'}")
-                logger.debug(f"Process restart flag: {self.process_monitor.process_restarted}")
+                if debug_enabled:
+                    logger.debug(f"Current process PID: {current_process.pid if current_process else 'None'}, status: {current_process.poll() if current_process else 'N/A'}")
+                    logger.debug(f"Process restart flag: {self.process_monitor.process_restarted}")
                 
                 # Create pcap reader from current process output
                 try:
                     pcap_reader = dpkt.pcap.Reader(current_process.stdout)
-                    logger.debug(f"Created pcap reader for process PID: {current_process.pid}")
+                    # Link type is fixed per capture; read it once instead of per packet
+                    datalink = pcap_reader.datalink()
+                    if debug_enabled:
+                        logger.debug(f"Created pcap reader for process PID: {current_process.pid}")
                     
                     # Read packets from current process
                     while True:
@@ -408,20 +453,20 @@ class SenderAudioRecovery:
                             # Parse Ethernet frame
                             try:
                                 # Handle different datalink types
-                                if pcap_reader.datalink() == dpkt.pcap.DLT_EN10MB:
+                                if datalink == dpkt.pcap.DLT_EN10MB:
                                     eth = dpkt.ethernet.Ethernet(buf)
                                     if not isinstance(eth.data, dpkt.ip.IP):
                                         continue
                                     ip = eth.data
-                                elif pcap_reader.datalink() == dpkt.pcap.DLT_LINUX_SLL:
+                                elif datalink == dpkt.pcap.DLT_LINUX_SLL:
                                     sll = dpkt.sll.SLL(buf)
                                     if not isinstance(sll.data, dpkt.ip.IP):
                                         continue
                                     ip = sll.data
-                                elif pcap_reader.datalink() == dpkt.pcap.DLT_RAW or pcap_reader.datalink() == 101:
+                                elif datalink == dpkt.pcap.DLT_RAW or datalink == 101:
                                     ip = dpkt.ip.IP(buf)
                                 else:
-                                    logger.warning(f"Unsupported datalink type: {pcap_reader.datalink()}")
+                                    logger.warning("Unsupported datalink type: %s", datalink)
                                     continue
                                 
                                 # Extract IP addresses
@@ -429,7 +474,7 @@ class SenderAudioRecovery:
                                 dst_ip = socket.inet_ntoa(ip.dst)
                                 
                                 # Filter packets not containing hotline server IP
-                                if self.hotline_server_ip not in [src_ip, dst_ip]:
+                                if self.hotline_server_ip != src_ip and self.hotline_server_ip != dst_ip:
                                     continue
                                 
                                 # IP filtering (blacklist)
@@ -467,10 +512,9 @@ class SenderAudioRecovery:
                                         session.add_rtp_packet(stream_id, rtp_info)
                                         
                                     processed_packets += 1
-                                    last_activity_time = time.time()
                                     
-                                    if processed_packets % 100 == 0:
-                                        logger.debug(f"Processed {processed_packets} RTP packets")
+                                    if debug_enabled and (processed_packets & PROGRESS_LOG_MASK) == 0:
+                                        logger.debug("Processed %d RTP packets", processed_packets)
                                 
                                 # Try to parse as RTCP packet
                                 bye_ssrcs = self.parse_rtcp_packet(payload_bytes)
@@ -566,16 +610,21 @@ class Session:
         self.session_key = session_key
         self.peer_ip = peer_ip
         self.session_unique_id = f"{int(time.time() * 1000)}_{uuid.uuid4()}"  # 时间戳 + UUID
-        self.streams = {}  # stream_id -> {'ssrc', 'direction', 'packets', 'codec', 'connection_info'}
+        self.streams = {}  # stream_id -> {'ssrc', 'direction', 'codec', 'connection_info'}
         self.last_activity = time.time()  # Record last activity time
         
         # ZMQ publishing related
         self.publisher = publisher  # callable(peer_ip, direction, pcm_bytes, start_ts, end_ts)
         self.chunk_bytes = int(chunk_bytes)
-        # One segment buffer queue per direction: [{ 'ts': float, 'pcm': bytes }]
+        # One segment buffer queue per direction: deque of { 'ts': float, 'pcm': bytes }
         self.direction_segments = {
-            'citizen': [],
-            'hotline': []
+            'citizen': deque(),
+            'hotline': deque()
+        }
+        # Running byte count of each queue, so draining does not re-sum the segments per packet
+        self.direction_bytes = {
+            'citizen': 0,
+            'hotline': 0
         }
         self.published_any = {
             'citizen': False,
@@ -590,7 +639,6 @@ class Session:
         self.streams[stream_id] = {
             'ssrc': ssrc,
             'direction': direction,
-            'packets': [],
             'codec': codec,
             'src_ip': src_ip,
             'dst_ip': dst_ip,
@@ -615,23 +663,26 @@ class Session:
                 
                 # Check time window - only pair streams within last 30 seconds
                 if 'last_packet_time' not in stream_info or (current_time - stream_info['last_packet_time']) < 30:
-                    logger.debug(f"Found paired stream: {stream_id}, direction: {stream_info['direction']}")
+                    logger.debug("Found paired stream: %s, direction: %s", stream_id, stream_info['direction'])
                     return True
                 else:
-                    logger.debug(f"Stream {stream_id} exceeded time window ({current_time - stream_info['last_packet_time']:.2f}s), not pairing")
+                    logger.debug("Stream %s exceeded time window (%.2fs), not pairing", stream_id, current_time - stream_info['last_packet_time'])
         return False
     
     def add_rtp_packet(self, stream_id, rtp_info):
         """Add RTP packet to specified stream"""
-        if stream_id in self.streams:
-            self.streams[stream_id]['packets'].append(rtp_info)
-            self.streams[stream_id]['last_packet_time'] = time.time()  # Record last packet time
-            self.last_activity = time.time()  # Update last activity time
+        stream = self.streams.get(stream_id)
+        if stream is not None:
+            # One clock read per packet, shared by the activity stamps and the segment fallback ts
+            now = time.time()
+            # Packets are not retained: audio is decoded and chunked right away below
+            stream['last_packet_time'] = now  # Record last packet time
+            self.last_activity = now  # Update last activity time
             # Real-time chunking and publish to ZMQ (if enabled)
             if self.publisher:
-                self._ingest_and_maybe_publish(self.streams[stream_id]['direction'], self.streams[stream_id]['codec'], rtp_info)
+                self._ingest_and_maybe_publish(stream['direction'], stream['codec'], rtp_info, now)
 
-    def _ingest_and_maybe_publish(self, direction, codec, rtp_info):
+    def _ingest_and_maybe_publish(self, direction, codec, rtp_info, now):
         """Decode single RTP packet and add to direction segment queue, publish when chunk size is met"""
         audio_bytes = rtp_info.get('audio_data', b'')
         if not audio_bytes:
@@ -655,7 +706,8 @@ class Session:
         seg_list = self.direction_segments.get(direction)
         if seg_list is None:
             return
-        seg_list.append({'ts': rtp_info.get('pcap_ts', time.time()), 'pcm': pcm})
+        seg_list.append({'ts': rtp_info.get('pcap_ts', now), 'pcm': pcm})
+        self.direction_bytes[direction] += len(pcm)
         # Try to publish as many complete chunks as possible
         self._drain_full_chunks(direction)
 
@@ -663,8 +715,7 @@ class Session:
         seg_list = self.direction_segments.get(direction)
         if not seg_list:
             return
-        total_bytes = sum(len(seg['pcm']) for seg in seg_list)
-        while total_bytes >= self.chunk_bytes:
+        while self.direction_bytes[direction] >= self.chunk_bytes:
             # Assemble a chunk
             chunk_parts = []
             consumed = 0
@@ -672,7 +723,7 @@ class Session:
             end_ts = start_ts
             # Pop segments from left to right
             while seg_list and consumed + len(seg_list[0]['pcm']) <= self.chunk_bytes:
-                seg = seg_list.pop(0)
+                seg = seg_list.popleft()
                 chunk_parts.append(seg['pcm'])
                 consumed += len(seg['pcm'])
                 end_ts = seg['ts']
@@ -680,8 +731,10 @@ class Session:
                 # Need to cut part from next segment
                 seg = seg_list[0]
                 need = self.chunk_bytes - consumed
-                take = seg['pcm'][:need]
-                remain = seg['pcm'][need:]
+                # memoryview slices: no copy until b''.join builds the chunk
+                pcm_view = memoryview(seg['pcm'])
+                take = pcm_view[:need]
+                remain = pcm_view[need:]
                 chunk_parts.append(take)
                 consumed += len(take)
                 end_ts = seg['ts']
@@ -690,7 +743,7 @@ class Session:
             # Publish
             chunk_pcm = b''.join(chunk_parts)
             self._publish_chunk(direction, chunk_pcm, start_ts, end_ts, is_finished=False)
-            total_bytes -= self.chunk_bytes
+            self.direction_bytes[direction] -= self.chunk_bytes
 
     def _publish_chunk(self, direction, pcm_bytes, start_ts, end_ts, is_finished):
         if not self.publisher or not pcm_bytes:
@@ -707,6 +760,8 @@ class Session:
             # No need to publish
             self.direction_segments['citizen'].clear()
             self.direction_segments['hotline'].clear()
+            self.direction_bytes['citizen'] = 0
+            self.direction_bytes['hotline'] = 0
             return
         for direction in ['citizen', 'hotline']:
             seg_list = self.direction_segments.get(direction, [])
@@ -718,6 +773,7 @@ class Session:
                 if chunk_pcm:
                     self._publish_chunk(direction, chunk_pcm, start_ts, end_ts, is_finished=True)
                 seg_list.clear()
+                self.direction_bytes[direction] = 0
             else:
                 # If exactly on chunk boundary, ensure end marker is sent
                 if self.published_any.get(direction, False):
@@ -743,6 +799,7 @@ def main():
     parser = argparse.ArgumentParser(description='Sender-side audio recovery from RTP stream')
     parser.add_argument('--zmq-endpoint', default='tcp://100.120.241.10:5556', help='ZMQ endpoint (default: tcp://100.120.241.10:5556)')
     parser.add_argument('--chunk-seconds', type=float, default=2.0, help='Audio chunk duration in seconds (default: 2.0)')
+    parser.add_argument('--meta-format', choices=['json', 'msgpack'], default='json', help='Chunk metadata encoding (default: json; msgpack needs the msgpack package on both ends)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
     
     args = parser.parse_args()
@@ -752,7 +809,8 @@ def main():
     
     recovery = SenderAudioRecovery(
         zmq_endpoint=args.zmq_endpoint,
-        chunk_seconds=args.chunk_seconds
+        chunk_seconds=args.chunk_seconds,
+        meta_format=args.meta_format
     )
     recovery.process_pcap_streaming()
 
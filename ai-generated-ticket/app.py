@@ -12,14 +12,15 @@ import re
 import itertools
 import random
 import os
+import threading
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from pathlib import Path
 
 import requests
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ValidationError
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
 import uvicorn
 
 
@@ -88,6 +89,8 @@ class DeepSeekLoadBalancer:
         self.health_status = {ep: True for ep in endpoints}
         self.request_count = {ep: 0 for ep in endpoints}
         self.error_count = {ep: 0 for ep in endpoints}
+        # summarize() 在线程池中执行，轮询、健康状态与计数的读写都需持锁
+        self._lock = threading.Lock()
 
         logger.info(f"初始化DeepSeek负载均衡器，节点数: {len(endpoints)}")
         for ep in endpoints:
@@ -100,19 +103,20 @@ class DeepSeekLoadBalancer:
         Returns:
             可用的端点URL
         """
-        # 尝试找到健康的节点
-        for _ in range(len(self.endpoints)):
-            endpoint = next(self.round_robin)
-            if self.health_status.get(endpoint, True):
-                self.request_count[endpoint] += 1
-                logger.debug(f"选择节点: {endpoint} (请求数: {self.request_count[endpoint]})")
-                return endpoint
-
-        # 所有节点都不健康，随机选择一个重试
-        logger.warning("所有DeepSeek节点都不健康，随机选择节点重试")
-        endpoint = random.choice(self.endpoints)
-        self.request_count[endpoint] += 1
-        return endpoint
+        with self._lock:
+            # 尝试找到健康的节点
+            for _ in range(len(self.endpoints)):
+                endpoint = next(self.round_robin)
+                if self.health_status.get(endpoint, True):
+                    self.request_count[endpoint] += 1
+                    logger.debug("选择节点: %s (请求数: %d)", endpoint, self.request_count[endpoint])
+                    return endpoint
+
+            # 所有节点都不健康，随机选择一个重试
+            logger.warning("所有DeepSeek节点都不健康，随机选择节点重试")
+            endpoint = random.choice(self.endpoints)
+            self.request_count[endpoint] += 1
+            return endpoint
 
     def mark_unhealthy(self, endpoint: str):
         """
@@ -121,11 +125,13 @@ class DeepSeekLoadBalancer:
         Args:
             endpoint: 节点URL
         """
-        self.health_status[endpoint] = False
-        self.error_count[endpoint] += 1
+        with self._lock:
+            self.health_status[endpoint] = False
+            self.error_count[endpoint] += 1
+            error_count = self.error_count[endpoint]
         logger.warning(
             f"节点标记为不健康: {endpoint} "
-            f"(累计错误: {self.error_count[endpoint]})"
+            f"(累计错误: {error_count})"
         )
 
     def mark_healthy(self, endpoint: str):
@@ -135,8 +141,9 @@ class DeepSeekLoadBalancer:
         Args:
             endpoint: 节点URL
         """
-        was_unhealthy = not self.health_status.get(endpoint, True)
-        self.health_status[endpoint] = True
+        with self._lock:
+            was_unhealthy = not self.health_status.get(endpoint, True)
+            self.health_status[endpoint] = True
         if was_unhealthy:
             logger.info(f"节点恢复健康: {endpoint}")
 
@@ -147,19 +154,20 @@ class DeepSeekLoadBalancer:
         Returns:
             统计信息字典
         """
-        return {
-            "total_endpoints": len(self.endpoints),
-            "healthy_endpoints": sum(1 for h in self.health_status.values() if h),
-            "endpoints": [
-                {
-                    "url": ep,
-                    "healthy": self.health_status[ep],
-                    "request_count": self.request_count[ep],
-                    "error_count": self.error_count[ep]
-                }
-                for ep in self.endpoints
-            ]
-        }
+        with self._lock:
+            return {
+                "total_endpoints": len(self.endpoints),
+                "healthy_endpoints": sum(1 for h in self.health_status.values() if h),
+                "endpoints": [
+                    {
+                        "url": ep,
+                        "healthy": self.health_status[ep],
+                        "request_count": self.request_count[ep],
+                        "error_count": self.error_count[ep]
+                    }
+                    for ep in self.endpoints
+                ]
+            }
 
 
 # 创建全局负载均衡器实例
@@ -189,6 +197,12 @@ def load_location_data() -> str:
 
 LOCATION_CONTEXT = load_location_data()
 
+# 模型输出清洗用的正则，模块加载时编译一次
+_THINK_BLOCK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_CODE_FENCE_RE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+
 
 class LocationCorrector:
     """地名矫正器：使用LLM进行地名矫正"""
@@ -284,8 +298,8 @@ class LocationCorrector:
             corrected = result.get('response', '').strip()
 
             # 移除可能的<think>标签和多余内容
-            corrected = re.sub(r'<think>.*?</think>', '', corrected, flags=re.DOTALL)
-            corrected = re.sub(r'<[^>]+>', '', corrected)
+            corrected = _THINK_BLOCK_RE.sub('', corrected)
+            corrected = _HTML_TAG_RE.sub('', corrected)
             corrected = corrected.strip()
 
             logger.info(f"LLM地名矫正 (节点: {endpoint}): '{raw_zone}' -> '{corrected}'")
@@ -399,17 +413,18 @@ class TicketSummarizer:
 
     def format_conversation(self, conversation_data: Dict[str, List[Dict]]) -> str:
         """格式化对话内容为可读文本"""
-        formatted_text = "通话记录：\n"
+        # 收集片段后一次 join，避免长对话逐行 += 反复复制整段文本
+        parts = ["通话记录：\n"]
 
         for session_id, messages in conversation_data.items():
-            formatted_text += f"\n会话ID: {session_id}\n"
-            for i, message in enumerate(messages):
-                if "citizen" in message and message["citizen"]:
-                    formatted_text += f"市民: {message['citizen']}\n"
-                elif "hot-line" in message and message["hot-line"]:
-                    formatted_text += f"接线员: {message['hot-line']}\n"
+            parts.append(f"\n会话ID: {session_id}\n")
+            for message in messages:
+                if message.get("citizen"):
+                    parts.append(f"市民: {message['citizen']}\n")
+                elif message.get("hot-line"):
+                    parts.append(f"接线员: {message['hot-line']}\n")
 
-        return formatted_text
+        return "".join(parts)
 
     def call_deepseek_model(self, prompt: str) -> str:
         """调用 Ollama 模型（使用负载均衡）"""
@@ -452,26 +467,24 @@ class TicketSummarizer:
 
     def extract_json_from_response(self, response_text: str) -> str:
         """从模型响应中提取JSON内容"""
-        import re
-
         # 移除前后空白
         text = response_text.strip()
 
         # 移除 <think>...</think> 标签及其内容
-        text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+        text = _THINK_BLOCK_RE.sub('', text)
 
         # 移除其他可能的XML/HTML标签
-        text = re.sub(r'<[^>]+>', '', text)
+        text = _HTML_TAG_RE.sub('', text)
 
         # 处理markdown代码块
         if '```json' in text:
             # 提取 ```json ... ``` 中的内容
-            json_match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+            json_match = _JSON_FENCE_RE.search(text)
             if json_match:
                 text = json_match.group(1)
         elif '```' in text:
             # 提取 ``` ... ``` 中的内容
-            code_match = re.search(r'```\s*(.*?)\s*```', text, re.DOTALL)
+            code_match = _CODE_FENCE_RE.search(text)
             if code_match:
                 text = code_match.group(1)
 
@@ -504,7 +517,7 @@ class TicketSummarizer:
 
         if end_idx != -1:
             extracted_json = text[start_idx:end_idx + 1]
-            logger.debug(f"提取的JSON: {extracted_json}")
+            logger.debug("提取的JSON: %s", extracted_json)
             return extracted_json
         else:
             logger.warning(f"未找到JSON结束标记，返回处理后的文本: {text[:200]}...")
@@ -622,7 +635,7 @@ summarizer = TicketSummarizer(location_corrector)
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """记录所有请求"""
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     # 记录请求
     logger.info(f"收到请求: {request.method} {request.url}")
@@ -630,7 +643,7 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
 
     # 记录响应时间
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
     logger.info(f"请求处理完成，耗时: {process_time:.2f}秒")
 
     return response
@@ -652,7 +665,8 @@ async def health_check():
     try:
         # 测试 DeepSeek 服务连接（测试第一个节点）
         test_endpoint = DEEPSEEK_ENDPOINTS[0].replace('/api/generate', '')
-        test_response = requests.get(test_endpoint, timeout=5)
+        # 阻塞的 HTTP 探测放到线程池，避免最长 5 秒卡住事件循环
+        test_response = await run_in_threadpool(requests.get, test_endpoint, timeout=5)
         deepseek_status = "healthy" if test_response.status_code == 200 else "unhealthy"
     except:
         deepseek_status = "unreachable"
@@ -720,14 +734,14 @@ async def summarize_ticket(request: Request):
                 if not any(key in message for key in ['citizen', 'hot-line']):
                     logger.warning(f"消息 {i+1} 既不包含 'citizen' 也不包含 'hot-line' 字段")
 
-        logger.debug(f"解析的对话数据: {conversation_data}")
+        logger.debug("解析的对话数据: %s", conversation_data)
 
-        # 执行工单总结
-        result = summarizer.summarize(conversation_data)
+        # 执行工单总结（阻塞的模型调用放到线程池，避免卡住事件循环）
+        result = await run_in_threadpool(summarizer.summarize, conversation_data)
 
         # 记录结果
         logger.info(f"生成工单: {result['ticket_title']}")
-        logger.debug(f"完整工单内容: {result}")
+        logger.debug("完整工单内容: %s", result)
 
         return result
 
@@ -746,10 +760,15 @@ if __name__ == "__main__":
     for i, ep in enumerate(DEEPSEEK_ENDPOINTS, 1):
         logger.info(f"  - 节点{i}: {ep}")
 
+    # 多进程时每个 worker 各自维护负载均衡轮询与统计（/lb-stats 只反映处理该请求的 worker）
+    ticket_workers = max(1, int(os.environ.get('TICKET_WORKERS', '1')))
+    logger.info(f"worker 数: {ticket_workers}")
+
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=8001,
         reload=False,
+        workers=ticket_workers,
         log_level="info"
     )
\ No newline at end of file
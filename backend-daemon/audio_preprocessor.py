@@ -22,13 +22,25 @@ Usage:
     cleaned = preprocessor.process(near_end_audio)
 """
 
-import os
 import logging
 import numpy as np
 from typing import Optional
 
 log = logging.getLogger("ASRDaemon.AudioPreprocessor")
 
+INT16_TO_FLOAT = np.float32(1.0 / 32768.0)
+FLOAT_TO_INT16 = np.float32(32768.0)
+# Shared read-only empty buffer for "no leftover samples" / "no output yet"
+_EMPTY_I16 = np.empty(0, dtype=np.int16)
+_EMPTY_I16.setflags(write=False)
+
+
+def _float_to_int16(audio: np.ndarray) -> np.ndarray:
+    """Scale normalized float audio to int16 using one float32 temporary (clipped, no wrap-around)."""
+    scaled = np.multiply(audio, FLOAT_TO_INT16, dtype=np.float32)
+    np.clip(scaled, -32768.0, 32767.0, out=scaled)
+    return scaled.astype(np.int16)
+
 
 class AudioPreprocessor:
     """
@@ -77,8 +89,11 @@ class AudioPreprocessor:
         self._use_speex = False
 
         # Audio buffers for frame alignment
-        self._near_buffer = np.array([], dtype=np.int16)
-        self._far_buffer = np.array([], dtype=np.int16)
+        self._near_buffer = _EMPTY_I16
+        self._far_buffer = _EMPTY_I16
+
+        # High-pass (b, a) for the fallback noise suppression, designed on first use
+        self._ns_highpass = None
 
         self._init_aec()
 
@@ -182,8 +197,8 @@ class AudioPreprocessor:
         """Process audio using WebRTC APM."""
         try:
             # WebRTC expects float32 in [-1, 1]
-            near_float = near_audio.astype(np.float32) / 32768.0
-            far_float = far_audio.astype(np.float32) / 32768.0
+            near_float = np.multiply(near_audio, INT16_TO_FLOAT, dtype=np.float32)
+            far_float = np.multiply(far_audio, INT16_TO_FLOAT, dtype=np.float32)
 
             # Process
             processed_float = self._webrtc_apm.process_stream(
@@ -192,8 +207,7 @@ class AudioPreprocessor:
             )
 
             # Convert back to int16
-            processed = (processed_float * 32768.0).astype(np.int16)
-            return processed
+            return _float_to_int16(processed_float)
 
         except Exception as e:
             log.error(f"WebRTC processing error: {e}")
@@ -206,38 +220,37 @@ class AudioPreprocessor:
     ) -> np.ndarray:
         """Process audio using Speex echo canceller frame by frame."""
         try:
-            # Add new audio to buffers
-            self._near_buffer = np.concatenate([self._near_buffer, near_audio])
-            self._far_buffer = np.concatenate([self._far_buffer, far_audio])
+            # Prepend leftovers from the previous call (no copy when there are none)
+            near_buf = np.concatenate([self._near_buffer, near_audio]) if self._near_buffer.size else near_audio
+            far_buf = np.concatenate([self._far_buffer, far_audio]) if self._far_buffer.size else far_audio
 
-            # Process complete frames
+            # Process complete frames by offset; frames are views into the buffers
+            frame_size = self.frame_size
+            n_frames = min(near_buf.size, far_buf.size) // frame_size
             output_frames = []
-            while len(self._near_buffer) >= self.frame_size and len(self._far_buffer) >= self.frame_size:
-                near_frame = self._near_buffer[:self.frame_size]
-                far_frame = self._far_buffer[:self.frame_size]
-
-                # Process frame
+            for offset in range(0, n_frames * frame_size, frame_size):
                 cleaned_frame = self._speex_aec.process(
-                    input_frame=near_frame,
-                    echo_frame=far_frame
+                    input_frame=near_buf[offset:offset + frame_size],
+                    echo_frame=far_buf[offset:offset + frame_size]
                 )
                 output_frames.append(cleaned_frame)
 
-                # Remove processed frames
-                self._near_buffer = self._near_buffer[self.frame_size:]
-                self._far_buffer = self._far_buffer[self.frame_size:]
+            # Keep only the unprocessed tails; copy so the whole chunk is not kept alive by a view
+            consumed = n_frames * frame_size
+            self._near_buffer = near_buf[consumed:].copy() if near_buf.size > consumed else _EMPTY_I16
+            self._far_buffer = far_buf[consumed:].copy() if far_buf.size > consumed else _EMPTY_I16
 
             if output_frames:
                 return np.concatenate(output_frames)
             else:
                 # Not enough data for a complete frame
-                return np.array([], dtype=np.int16)
+                return _EMPTY_I16
 
         except Exception as e:
             log.error(f"Speex processing error: {e}")
             # Clear buffers on error
-            self._near_buffer = np.array([], dtype=np.int16)
-            self._far_buffer = np.array([], dtype=np.int16)
+            self._near_buffer = _EMPTY_I16
+            self._far_buffer = _EMPTY_I16
             return near_audio
 
     def _simple_noise_suppression(self, audio: np.ndarray) -> np.ndarray:
@@ -250,24 +263,30 @@ class AudioPreprocessor:
             if len(audio) == 0:
                 return audio
 
+            # Convert once; the RMS, attenuation and filter below all work on this float32 copy
+            x = audio.astype(np.float32)
+
             # Calculate RMS energy
-            rms = np.sqrt(np.mean(audio.astype(np.float32) ** 2))
+            rms = np.sqrt(np.dot(x, x) / x.size)
 
             # Adaptive threshold (10% of max possible RMS)
             threshold = 3276.8  # 0.1 * 32768
 
             if rms < threshold:
                 # Below threshold: apply aggressive attenuation
-                return (audio * 0.1).astype(np.int16)
+                x *= np.float32(0.1)
+                return x.astype(np.int16)
             else:
                 # Above threshold: apply light noise reduction
                 # Simple high-pass filter to remove low-frequency noise
                 if len(audio) > 10:
                     from scipy.signal import butter, filtfilt
-                    nyquist = self.sample_rate / 2
-                    cutoff = 100  # 100 Hz high-pass
-                    b, a = butter(2, cutoff / nyquist, btype='high')
-                    filtered = filtfilt(b, a, audio.astype(np.float32))
+                    if self._ns_highpass is None:
+                        nyquist = self.sample_rate / 2
+                        cutoff = 100  # 100 Hz high-pass
+                        self._ns_highpass = butter(2, cutoff / nyquist, btype='high')
+                    b, a = self._ns_highpass
+                    filtered = filtfilt(b, a, x)
                     return filtered.astype(np.int16)
                 return audio
 
@@ -281,14 +300,14 @@ class AudioPreprocessor:
             return audio
         elif audio.dtype in (np.float32, np.float64):
             # Assume normalized float in [-1, 1]
-            return (audio * 32768.0).astype(np.int16)
+            return _float_to_int16(audio)
         else:
             return audio.astype(np.int16)
 
     def reset(self):
         """Reset internal buffers and state."""
-        self._near_buffer = np.array([], dtype=np.int16)
-        self._far_buffer = np.array([], dtype=np.int16)
+        self._near_buffer = _EMPTY_I16
+        self._far_buffer = _EMPTY_I16
 
         # Reset Speex state if using it
         if self._use_speex and self._speex_aec:
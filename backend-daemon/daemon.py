@@ -5,8 +5,8 @@ os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
 os.environ.setdefault("TRANSFORMERS_NO_ADVISORY_WARNINGS", "1")
 
 import sys
-import json
 import time
+import hashlib
 import logging
 from typing import Dict, Tuple, Optional
 
@@ -15,24 +15,34 @@ root_dir = os.path.abspath(os.path.join(script_dir, ".."))
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
 
-from common.logging_utils import configure_rotating_logger, NoRTFilter, log_event
+from common.logging_utils import configure_rotating_logger, enable_queue_logging, NoRTFilter, log_event
+from common import json_utils
 
 import numpy as np
 import scipy.signal
 import zmq
 import math
 import heapq
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass, field
+from functools import lru_cache
 
 
 # ================= Priority Queue for Event Ordering =================
-@dataclass(order=True)
+@dataclass(order=True, slots=True)
 class PendingEvent:
     """Event pending to be published, ordered by voice_start_ts"""
     voice_start_ts: float
     event: dict = field(compare=False)
-    receive_time: float = field(compare=False)
+    receive_time: float = field(compare=False)  # time.monotonic() at enqueue
+
+
+@dataclass(slots=True)
+class CallState:
+    """Per-call counters kept between chunks of the same stream"""
+    chunks: int = 0
+    byte_count: int = 0
+    last_text: Optional[str] = None
 
 
 class EventQueueManager:
@@ -53,10 +63,10 @@ class EventQueueManager:
         # peer_ip -> last published voice_start_ts
         self.last_published: Dict[str, float] = {}
 
-    def add_event(self, event: dict, voice_start_ts: float):
-        """Add an event to the appropriate peer_ip queue"""
+    def add_event(self, event: dict, voice_start_ts: float, now: Optional[float] = None):
+        """Add an event to the appropriate peer_ip queue (`now` lets callers share one clock read)"""
         peer_ip = event.get('peer_ip', 'unknown')
-        receive_time = time.time()
+        receive_time = time.monotonic() if now is None else now
 
         pending = PendingEvent(
             voice_start_ts=voice_start_ts,
@@ -65,12 +75,12 @@ class EventQueueManager:
         )
         heapq.heappush(self.queues[peer_ip], pending)
 
-    def try_publish_ready_events(self):
+    def try_publish_ready_events(self, now: Optional[float] = None):
         """
         Publish events in order by voice_start_ts (min heap).
         Events must wait at least min_buffer_sec before publishing to allow out-of-order events to arrive.
         """
-        current_time = time.time()
+        current_time = time.monotonic() if now is None else now
 
         for peer_ip, queue in list(self.queues.items()):
             if not queue:
@@ -88,7 +98,7 @@ class EventQueueManager:
                     heapq.heappop(queue)
 
                     try:
-                        self.pub_sock.send_json(earliest.event, ensure_ascii=False)
+                        self.pub_sock.send(json_utils.dumpb(earliest.event))
                         self.last_published[peer_ip] = earliest.voice_start_ts
 
                         log_event(
@@ -110,13 +120,21 @@ class EventQueueManager:
             if not queue:
                 del self.queues[peer_ip]
 
+    def seconds_until_ready(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until some queue head has waited min_buffer_sec (0 if one is due), or None if nothing is pending."""
+        heads = [queue[0].receive_time for queue in self.queues.values() if queue]
+        if not heads:
+            return None
+        current_time = time.monotonic() if now is None else now
+        return max(0.0, min(heads) + self.min_buffer_sec - current_time)
+
     def flush_all(self):
         """Flush all pending events (call on shutdown or call_finished)"""
         for peer_ip, queue in list(self.queues.items()):
             while queue:
                 pending = heapq.heappop(queue)
                 try:
-                    self.pub_sock.send_json(pending.event, ensure_ascii=False)
+                    self.pub_sock.send(json_utils.dumpb(pending.event))
                 except Exception as e:
                     log_event(log, 'pub_send_error', error=str(e))
             del self.queues[peer_ip]
@@ -128,7 +146,7 @@ class EventQueueManager:
             while queue:
                 pending = heapq.heappop(queue)
                 try:
-                    self.pub_sock.send_json(pending.event, ensure_ascii=False)
+                    self.pub_sock.send(json_utils.dumpb(pending.event))
                 except Exception as e:
                     log_event(log, 'pub_send_error', error=str(e))
             del self.queues[peer_ip]
@@ -167,6 +185,8 @@ stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
 stream_handler.addFilter(NoRTFilter())
 log.addHandler(stream_handler)
+# Per-event file/console writes run on a listener thread instead of the caller
+enable_queue_logging(log)
 # --- End Logging Setup ---
 
 # Suppress root logger messages from funasr decoding
@@ -181,9 +201,15 @@ logging.getLogger().addFilter(FunasrFilter())
 # ================= Config =================
 # Input ZMQ endpoint where raw PCM chunks arrive (producer sends via PUSH)
 INPUT_ZMQ_ENDPOINT = os.getenv("INPUT_ZMQ_ENDPOINT", "tcp://0.0.0.0:5556")
+# PULL receive queue bounds: chunks beyond RCVHWM make the sender's NOBLOCK send drop; RCVBUF <= 0 keeps the OS default
+INPUT_ZMQ_RCVHWM = max(0, int(os.getenv("INPUT_ZMQ_RCVHWM", "1000")))
+INPUT_ZMQ_RCVBUF = int(os.getenv("INPUT_ZMQ_RCVBUF", "0"))
 
 # Output ZMQ endpoint to publish recognized text events (WS server subscribes)
 OUTPUT_ZMQ_ENDPOINT = os.getenv("OUTPUT_ZMQ_ENDPOINT", "tcp://100.120.2.227:5557")
+# PUB connects to the WS server's SUB bind by default; set to 1 to bind instead so several
+# WS server workers can each connect their own SUB (see ASR_EVENTS_BIND on the WS side)
+OUTPUT_ZMQ_BIND = os.getenv("OUTPUT_ZMQ_BIND", "0") == "1"
 
 # Model settings
 # Default to non-streaming model as requested
@@ -191,6 +217,8 @@ MODEL_NAME = os.getenv("ASR_MODEL", "paraformer-zh")
 MODEL_REV = os.getenv("ASR_MODEL_REV", "v2.0.4")
 ASR_INPUT_SR = int(os.getenv("ASR_INPUT_SAMPLE_RATE", "8000"))
 ASR_ENERGY_GATE = float(os.getenv("ASR_ENERGY_GATE", "0"))  # 0 disables gate
+# Chunks whose int16 peak after AEC/NS is below this are treated as silence and skip resample/ASR; 0 disables
+ASR_SILENCE_PEAK = int(os.getenv("ASR_SILENCE_PEAK", "16"))
 
 # AEC (Acoustic Echo Cancellation) settings
 ENABLE_AEC = os.getenv("ENABLE_AEC", "1") == "1"  # Enable AEC by default
@@ -199,17 +227,55 @@ ENABLE_AGC = os.getenv("ENABLE_AGC", "0") == "1"  # AGC disabled by default
 AEC_FRAME_SIZE_MS = int(os.getenv("AEC_FRAME_SIZE_MS", "10"))  # Frame size in ms
 AEC_FILTER_LENGTH_MS = int(os.getenv("AEC_FILTER_LENGTH_MS", "200"))  # Filter length in ms
 
+# Run one dummy inference right after loading so lazy model/device setup is paid before the first call
+ASR_WARMUP = os.getenv("ASR_WARMUP", "1") == "1"
+
+# Max queued PULL messages drained per loop; backlog chunks of one stream are merged into one ASR call
+ASR_MAX_BATCH = max(1, int(os.getenv("ASR_MAX_BATCH", "8")))
+
+# Opt-in LRU of ASR results keyed by a hash of the preprocessed audio. Live call audio is practically
+# never byte-identical after AEC/NS, so this only pays off for replayed test streams. 0 (default) disables it.
+ASR_RESULT_CACHE_SIZE = max(0, int(os.getenv("ASR_RESULT_CACHE_SIZE", "0")))
+
+# Resampler for non-16k input: "auto" uses soxr when installed, "poly" forces scipy resample_poly
+ASR_RESAMPLER = os.getenv("ASR_RESAMPLER", "auto").strip().lower()
+
+try:
+    import msgpack  # optional: decodes chunk meta from senders run with --meta-format msgpack
+except ImportError:
+    msgpack = None
+
 try:
-    import torch  # noqa: F401
+    import soxr  # optional: SIMD resampler, much cheaper than resample_poly per chunk
+except ImportError:
+    soxr = None
+
+try:
+    import torch
     DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
 except Exception:
+    torch = None
     DEVICE = "cpu"
 
+# Autocast model inference to fp16 on CUDA; off by default, enable after checking accuracy on real calls
+ASR_FP16 = os.getenv("ASR_FP16", "0") == "1" and DEVICE.startswith("cuda")
+
+
+# int16 PCM -> float32 [-1, 1) scale factor, applied in the same pass as the dtype cast
+INT16_TO_FLOAT = np.float32(1.0 / 32768.0)
+
+USE_SOXR = soxr is not None and ASR_RESAMPLER != "poly"
+
 
 # ================= ASR Model & Preprocessor =================
 asr_funasr_model = None
 audio_preprocessor = None
 
+# audio digest -> ASR result (None = no speech); only touched from the main loop thread
+_asr_result_cache: "OrderedDict[bytes, Optional[Dict]]" = OrderedDict()
+# Reused float32 buffer for the 16k model input, grown on demand; only touched from the main loop thread
+_asr_input_scratch = np.empty(0, dtype=np.float32)
+
 
 def load_funasr_model():
     global asr_funasr_model
@@ -235,6 +301,31 @@ def load_funasr_model():
     return asr_funasr_model
 
 
+def _model_generate(audio_f: np.ndarray):
+    """Call the FunASR model without autograd bookkeeping (and under fp16 autocast when ASR_FP16)."""
+    if torch is None:
+        return asr_funasr_model.generate(input=audio_f, sentence_timestamp=True)
+    with torch.inference_mode():
+        if ASR_FP16:
+            with torch.autocast("cuda", dtype=torch.float16):
+                return asr_funasr_model.generate(input=audio_f, sentence_timestamp=True)
+        return asr_funasr_model.generate(input=audio_f, sentence_timestamp=True)
+
+
+def warmup_funasr_model():
+    """Run one inference on low-level noise so the shared model is warm before real traffic arrives."""
+    if asr_funasr_model is None:
+        return
+    start = time.perf_counter()
+    try:
+        # Faint noise instead of zeros so VAD does not short-circuit before the ASR/punc stages
+        dummy = (np.random.default_rng(0).standard_normal(16000) * 1e-3).astype(np.float32)
+        _model_generate(dummy)
+        log_event(log, "asr_model_warmup_done", elapsed_ms=int((time.perf_counter() - start) * 1000))
+    except Exception as e:
+        log_event(log, "asr_model_warmup_failed", error=str(e))
+
+
 def load_audio_preprocessor():
     global audio_preprocessor
     if audio_preprocessor is not None:
@@ -257,31 +348,75 @@ def load_audio_preprocessor():
     return audio_preprocessor
 
 
+# FunASR puts the transcript under 'text'; the other keys cover other model output formats
+_TEXT_KEYS = ("text", "value", "transcript", "result", "sentence")
+
+
+def _text_from_dict(item: dict) -> Optional[str]:
+    for key in _TEXT_KEYS:
+        v = item.get(key)
+        if isinstance(v, str):
+            v = v.strip()
+            if v:
+                return v
+    return None
+
+
 def _extract_text(result) -> Optional[str]:
     try:
         if not result:
             return None
-        if isinstance(result, list) and result:
-            item = result[0]
-            if isinstance(item, dict):
-                for key in ("text", "value", "transcript", "result", "sentence"):
-                    v = item.get(key)
-                    if isinstance(v, str) and v.strip():
-                        return v.strip()
-            elif isinstance(item, str) and item.strip():
-                return item.strip()
-        elif isinstance(result, dict):
-            for key in ("text", "value", "transcript", "result", "sentence"):
-                v = result.get(key)
-                if isinstance(v, str) and v.strip():
-                    return v.strip()
-        elif isinstance(result, str) and result.strip():
-            return result.strip()
+        if isinstance(result, list):
+            result = result[0]
+        if isinstance(result, dict):
+            return _text_from_dict(result)
+        if isinstance(result, str):
+            return result.strip() or None
     except Exception:
         pass
     return None
 
 
+@lru_cache(maxsize=8)
+def _resample_plan(src_sr: int, dst_sr: int = 16000) -> Tuple[int, int, np.ndarray, int]:
+    """
+    Return (up, down, fir, n_pre_remove) for resampling int16 src_sr -> float32 dst_sr via upfirdn.
+
+    The taps match resample_poly's default Kaiser design and its output alignment; computing them
+    once per ratio avoids firwin() and resample_poly's per-call filter setup on every chunk. The
+    int16 -> [-1, 1) scale is folded into the taps so the filter output is the model input.
+    """
+    g = math.gcd(dst_sr, src_sr)
+    up = dst_sr // g
+    down = src_sr // g
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = scipy.signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+    # Same pre-padding resample_poly uses to centre the filter on the output grid
+    n_pre_pad = down - half_len % down
+    n_pre_remove = (half_len + n_pre_pad) // down
+    # float32 taps keep upfirdn in float32 for int16 input instead of promoting to float64
+    fir = np.concatenate((np.zeros(n_pre_pad), taps * (up / 32768.0))).astype(np.float32)
+    return up, down, fir, n_pre_remove
+
+
+def _resample_to_16k(audio: np.ndarray, src_sr: int) -> np.ndarray:
+    """Polyphase-resample int16 audio to scaled float32 at 16 kHz (resample_poly output, one call)."""
+    up, down, fir, n_pre_remove = _resample_plan(src_sr)
+    n_out = audio.size * up
+    n_out = n_out // down + bool(n_out % down)
+    out = scipy.signal.upfirdn(fir, audio, up, down)[n_pre_remove:n_pre_remove + n_out]
+    if out.size < n_out:
+        # resample_poly pads the filter tail with zeros; those output samples are exactly zero
+        out = np.concatenate((out, np.zeros(n_out - out.size, dtype=out.dtype)))
+    return out
+
+
+# Design the filter for the configured input rate at import so the first chunk does not pay for firwin()
+if not USE_SOXR and ASR_INPUT_SR != 16000:
+    _resample_plan(ASR_INPUT_SR if ASR_INPUT_SR > 0 else 8000)
+
+
 def _load_allow_list(path: str) -> Optional[set]:
     try:
         if not os.path.exists(path):
@@ -323,66 +458,285 @@ def _asr_generate_blocking(pcm_bytes: bytes, far_end_pcm: Optional[bytes] = None
             if audio.size == 0:
                 return None
 
-        # optional simple energy gate
-        if ASR_ENERGY_GATE > 0 and np.abs(audio).mean() < ASR_ENERGY_GATE:
+        # Cheap peak check (max/min avoid the abs(-32768) overflow). It runs after preprocessing so the
+        # stateful AEC still sees every near/far-end chunk and its frame buffers stay contiguous.
+        if ASR_SILENCE_PEAK > 0 and max(int(audio.max()), -int(audio.min())) < ASR_SILENCE_PEAK:
             return None
 
-        # resample to 16k for FunASR models
-        if ASR_INPUT_SR <= 0:
-            src_sr = 8000
-        else:
-            src_sr = ASR_INPUT_SR
-
-        if src_sr == 16000:
-            audio_f = audio.astype(np.float32) / 32768.0
-        else:
-            up = 16000
-            down = src_sr
-            g = math.gcd(up, down)
-            up //= g
-            down //= g
-            audio_f = scipy.signal.resample_poly(audio, up=up, down=down).astype(np.float32) / 32768.0
-
-        # Generate with sentence timestamp to get VAD info
-        result = asr_funasr_model.generate(
-            input=audio_f,
-            sentence_timestamp=True,  # Enable VAD timestamps
-        )
-
-        txt = _extract_text(result)
-        if not txt:
+        # optional simple energy gate; abs is taken as float32 in the scratch buffer (one pass, and
+        # no int16 wrap of abs(-32768)); _run_asr overwrites the scratch afterwards
+        if ASR_ENERGY_GATE > 0 and np.abs(audio, out=_scratch_f32(audio.size), dtype=np.float32).mean() < ASR_ENERGY_GATE:
             return None
 
-        # Extract VAD timestamp (first voice activity start time in ms)
-        vad_start_ms = 0
-        try:
-            if isinstance(result, list) and result:
-                item = result[0]
-                if isinstance(item, dict):
-                    # FunASR returns timestamp as [[start_ms, end_ms], ...]
-                    timestamp = item.get('timestamp')
-                    if timestamp and isinstance(timestamp, list) and len(timestamp) > 0:
-                        if isinstance(timestamp[0], list) and len(timestamp[0]) > 0:
-                            vad_start_ms = int(timestamp[0][0])
-        except Exception as e:
-            log_event(log, "vad_timestamp_extract_error", error=str(e))
+        if ASR_RESULT_CACHE_SIZE <= 0:
+            return _run_asr(audio)
 
-        return {
-            'text': txt,
-            'vad_start_ms': vad_start_ms
-        }
+        digest = hashlib.blake2b(np.ascontiguousarray(audio), digest_size=16).digest()
+        if digest in _asr_result_cache:
+            _asr_result_cache.move_to_end(digest)
+            return _asr_result_cache[digest]
+
+        asr_result = _run_asr(audio)
+        _asr_result_cache[digest] = asr_result
+        if len(_asr_result_cache) > ASR_RESULT_CACHE_SIZE:
+            _asr_result_cache.popitem(last=False)
+        return asr_result
     except Exception as e:
         log_event(log, "asr_generate_error", error=str(e))
     return None
 
 
+def _scratch_f32(n: int) -> np.ndarray:
+    """Return a length-n view of the shared float32 scratch buffer (contents undefined)."""
+    global _asr_input_scratch
+    if _asr_input_scratch.size < n:
+        _asr_input_scratch = np.empty(max(n, 2 * _asr_input_scratch.size), dtype=np.float32)
+    return _asr_input_scratch[:n]
+
+
+def _run_asr(audio: np.ndarray) -> Optional[Dict]:
+    """
+    Resample preprocessed int16 audio to 16k and run the model.
+
+    Same return shape as _asr_generate_blocking; exceptions propagate so a failed call is never cached.
+    """
+    # resample to 16k for FunASR models
+    if ASR_INPUT_SR <= 0:
+        src_sr = 8000
+    else:
+        src_sr = ASR_INPUT_SR
+
+    # Scale straight into the reused scratch buffer instead of allocating a new float32 array per chunk
+    if src_sr == 16000:
+        audio_f = np.multiply(audio, INT16_TO_FLOAT, out=_scratch_f32(audio.size))
+    elif USE_SOXR:
+        # Chunks are independent windows, so the one-shot (stateless) soxr call is the right fit
+        audio_f = soxr.resample(np.multiply(audio, INT16_TO_FLOAT, out=_scratch_f32(audio.size)), src_sr, 16000)
+    else:
+        audio_f = _resample_to_16k(audio, src_sr)
+
+    # Generate with sentence timestamp to get VAD info
+    result = _model_generate(audio_f)
+
+    # FunASR returns [{'key', 'text', 'timestamp', ...}]; unwrap once for both text and timestamp
+    item = result[0] if isinstance(result, list) and result else result
+    txt = _extract_text(item)
+    if not txt:
+        return None
+
+    # Extract VAD timestamp (first voice activity start time in ms)
+    vad_start_ms = 0
+    try:
+        if isinstance(item, dict):
+            # FunASR returns timestamp as [[start_ms, end_ms], ...]
+            timestamp = item.get('timestamp')
+            if timestamp and isinstance(timestamp, list):
+                first = timestamp[0]
+                if isinstance(first, list) and first:
+                    vad_start_ms = int(first[0])
+    except Exception as e:
+        log_event(log, "vad_timestamp_extract_error", error=str(e))
+
+    return {
+        'text': txt,
+        'vad_start_ms': vad_start_ms
+    }
+
+
+def _decode_meta(meta_raw) -> Dict:
+    """Decode chunk meta: JSON always starts with '{', anything else is msgpack (a map header byte)."""
+    if msgpack is None or meta_raw[:1] == b'{':
+        return json_utils.loads(meta_raw)
+    return msgpack.unpackb(meta_raw, raw=False)
+
+
+def _parse_message(msg_parts, allow_ips: Optional[set]) -> Optional[Dict]:
+    """Decode one 2- or 3-part PULL message into a chunk dict, or None if it must be skipped.
+
+    ``msg_parts`` are zero-copy frames; PCM stays a memoryview over the ZMQ message buffer.
+    """
+    # Receive message (can be 2-part or 3-part)
+    if len(msg_parts) == 2:
+        meta_raw, pcm = msg_parts[0].buffer, msg_parts[1].buffer
+        far_end_pcm = None
+    elif len(msg_parts) == 3:
+        meta_raw, pcm, far_end_pcm = msg_parts[0].buffer, msg_parts[1].buffer, msg_parts[2].buffer
+    else:
+        log_event(log, "invalid_msg_parts", parts=len(msg_parts))
+        return None
+
+    try:
+        meta = _decode_meta(meta_raw)
+    except Exception as e:
+        log_event(log, "meta_decode_error", error=str(e))
+        return None
+
+    peer_ip = meta.get('peer_ip', 'unknown')
+    source = meta.get('source', 'unknown')
+    unique_key = meta.get('unique_key')
+    ssrc = meta.get('ssrc')
+
+    # Whitelist filtering: if allow_list exists and is non-empty, only process whitelisted IPs
+    if allow_ips is not None and peer_ip not in allow_ips:
+        log_event(log, "ip_not_allowed", peer_ip=peer_ip, source=source, unique_key=unique_key, ssrc=ssrc)
+        return None
+
+    return {
+        'key': (peer_ip, source, unique_key, ssrc),
+        'peer_ip': peer_ip,
+        'source': source,
+        'unique_key': unique_key,
+        'ssrc': ssrc,
+        'start_ts': meta.get('start_ts'),
+        'end_ts': meta.get('end_ts'),
+        'is_finished': bool(meta.get('IsFinished', False)),
+        'pcm': pcm,
+        'far_end_pcm': far_end_pcm,
+        'count': 1,
+    }
+
+
+def _merge_backlog(chunks: list) -> list:
+    """
+    Merge queued chunks of the same stream so a backlog costs one ASR call per stream.
+
+    Per-stream order is preserved; a run is closed by IsFinished or a change in
+    far-end availability (AEC needs near/far audio to stay aligned).
+    """
+    if len(chunks) <= 1:
+        return chunks
+
+    merged = []
+    open_runs: Dict[Tuple, Dict] = {}
+    for chunk in chunks:
+        run = open_runs.get(chunk['key'])
+        if run is not None and (run['far_end_pcm'] is None) == (chunk['far_end_pcm'] is None):
+            # join() accepts the memoryview frames directly (memoryview has no "+")
+            run['pcm'] = b''.join((run['pcm'], chunk['pcm']))
+            if run['far_end_pcm'] is not None:
+                run['far_end_pcm'] = b''.join((run['far_end_pcm'], chunk['far_end_pcm']))
+            run['end_ts'] = chunk['end_ts']
+            run['is_finished'] = chunk['is_finished']
+            run['count'] += chunk['count']
+            if run['start_ts'] is None:
+                run['start_ts'] = chunk['start_ts']
+        else:
+            run = dict(chunk)
+            merged.append(run)
+            open_runs[chunk['key']] = run
+        if run['is_finished']:
+            open_runs.pop(chunk['key'], None)
+
+    if len(merged) < len(chunks):
+        log_event(log, "asr_backlog_merged", received=len(chunks), asr_calls=len(merged))
+    return merged
+
+
+def _handle_chunk(chunk: Dict, call_state: Dict[tuple, CallState], event_queue_mgr: "EventQueueManager", pub_sock) -> None:
+    """Run ASR for one (possibly merged) chunk and publish the resulting events."""
+    peer_ip = chunk['peer_ip']
+    source = chunk['source']
+    start_ts = chunk['start_ts']
+    unique_key = chunk['unique_key']
+    ssrc = chunk['ssrc']
+    is_finished = chunk['is_finished']
+    pcm = chunk['pcm']
+    far_end_pcm = chunk['far_end_pcm']
+
+    key = chunk['key']
+    st = call_state.get(key)
+    if st is None:
+        st = call_state[key] = CallState()
+
+    if pcm:
+        st.chunks += chunk['count']
+        st.byte_count += len(pcm)
+        # Pass far_end_pcm to ASR for AEC processing
+        asr_result = _asr_generate_blocking(pcm, far_end_pcm)
+        if asr_result:
+            txt = asr_result['text']
+            vad_start_ms = asr_result['vad_start_ms']
+            st.last_text = txt
+
+            # Calculate voice_start_ts based on chunk_start_ts + VAD offset
+            chunk_start_ts = start_ts if start_ts is not None else 0
+            voice_start_ts = chunk_start_ts + (vad_start_ms / 1000.0)
+
+            # Build event with new timestamp fields
+            event = {
+                'type': 'asr_update',
+                'text': txt,
+                'peer_ip': peer_ip,
+                'source': source,
+                'unique_key': unique_key,
+                'ssrc': ssrc,
+                'is_finished': is_finished,
+                # New timestamp fields
+                'voice_start_ts': voice_start_ts,  # Actual voice start time
+                'chunk_start_ts': chunk_start_ts,  # Original chunk start time
+                'offset_ms': vad_start_ms,  # VAD offset from chunk start
+            }
+            log_event(
+                log,
+                'asr_update_generated',
+                text=event['text'],
+                peer_ip=peer_ip,
+                source=source,
+                unique_key=unique_key,
+                ssrc=ssrc,
+                is_finished=is_finished,
+                voice_start_ts=voice_start_ts,
+                vad_offset_ms=vad_start_ms,
+            )
+
+            # One clock read for enqueueing and the readiness check (monotonic: only waits are measured)
+            now = time.monotonic()
+
+            # Add to priority queue instead of direct publish
+            event_queue_mgr.add_event(event, voice_start_ts, now=now)
+
+            # Try to publish ready events
+            event_queue_mgr.try_publish_ready_events(now=now)
+
+    if is_finished:
+        # Flush all pending events for this peer before sending call_finished
+        log_event(log, 'flushing_pending_events', peer_ip=peer_ip, source=source)
+        event_queue_mgr.flush_peer(peer_ip)
+
+        finish_evt = {
+            'type': 'call_finished',
+            'text': '',
+            'peer_ip': peer_ip,
+            'source': source,
+            'unique_key': unique_key,
+            'ssrc': ssrc,
+            'is_finished': True,
+        }
+        log_event(
+            log,
+            'call_finished_generated',
+            peer_ip=peer_ip,
+            source=source,
+            unique_key=unique_key,
+            ssrc=ssrc,
+            is_finished=is_finished,
+        )
+        try:
+            pub_sock.send(json_utils.dumpb(finish_evt))
+        except Exception as e:
+            log_event(log, 'pub_send_error', error=str(e))
+        # Drop the per-call counters so finished calls do not accumulate in call_state
+        call_state.pop(key, None)
+
+
 def main():
     log.info("========================================")
     log.info("ASR Backend Daemon - PULL->PUB")
     log.info("========================================")
-    log.info(f"Input ZMQ:  {INPUT_ZMQ_ENDPOINT} (PULL bind)")
-    log.info(f"Output ZMQ: {OUTPUT_ZMQ_ENDPOINT} (PUB bind)")
-    log.info(f"Model: {MODEL_NAME} rev={MODEL_REV} device={DEVICE}")
+    log.info(f"Input ZMQ:  {INPUT_ZMQ_ENDPOINT} (PULL bind, rcvhwm={INPUT_ZMQ_RCVHWM})")
+    log.info(f"Output ZMQ: {OUTPUT_ZMQ_ENDPOINT} (PUB {'bind' if OUTPUT_ZMQ_BIND else 'connect'})")
+    log.info(f"Model: {MODEL_NAME} rev={MODEL_REV} device={DEVICE} fp16={ASR_FP16}")
+    log.info(f"Resampler: {'soxr' if USE_SOXR else 'resample_poly'} (input {ASR_INPUT_SR} Hz)")
     log.info(f"AEC: enabled={ENABLE_AEC}, NS={ENABLE_NS}, AGC={ENABLE_AGC}")
 
     # Load whitelist from a file named 'allow_list' under the current script directory.
@@ -402,6 +756,9 @@ def main():
         log_event(log, "fatal_model_unavailable")
         raise SystemExit(2)
 
+    if ASR_WARMUP:
+        warmup_funasr_model()
+
     # Load audio preprocessor
     load_audio_preprocessor()
     if audio_preprocessor is None:
@@ -414,18 +771,25 @@ def main():
     pub_sock = ctx.socket(zmq.PUB)
     # Enable fast close
     pull_sock.setsockopt(zmq.LINGER, 0)
+    # Queue sizing must be set before bind to apply to accepted connections
+    pull_sock.setsockopt(zmq.RCVHWM, INPUT_ZMQ_RCVHWM)
+    if INPUT_ZMQ_RCVBUF > 0:
+        pull_sock.setsockopt(zmq.RCVBUF, INPUT_ZMQ_RCVBUF)
     pub_sock.setsockopt(zmq.LINGER, 0)
 
     try:
         pull_sock.bind(INPUT_ZMQ_ENDPOINT)
-        pub_sock.connect(OUTPUT_ZMQ_ENDPOINT)
-        log_event(log, "daemon_bind_ok", pull=INPUT_ZMQ_ENDPOINT, pub=OUTPUT_ZMQ_ENDPOINT)
+        if OUTPUT_ZMQ_BIND:
+            pub_sock.bind(OUTPUT_ZMQ_ENDPOINT)
+        else:
+            pub_sock.connect(OUTPUT_ZMQ_ENDPOINT)
+        log_event(log, "daemon_bind_ok", pull=INPUT_ZMQ_ENDPOINT, pub=OUTPUT_ZMQ_ENDPOINT, pub_bind=OUTPUT_ZMQ_BIND)
     except Exception as e:
         log_event(log, "daemon_bind_error", error=str(e))
         raise
 
     # state minimal: (peer_ip, source, unique_key, ssrc) -> {chunks, bytes}
-    call_state: Dict[Tuple[str, str, Optional[str], Optional[str]], Dict[str, object]] = {}
+    call_state: Dict[Tuple[str, str, Optional[str], Optional[str]], CallState] = {}
 
     # Initialize event queue manager
     event_queue_mgr = EventQueueManager(pub_sock, min_buffer_sec=2.0)
@@ -434,122 +798,37 @@ def main():
     try:
         while True:
             try:
-                # Receive message (can be 2-part or 3-part)
-                msg_parts = pull_sock.recv_multipart()
-                if len(msg_parts) == 2:
-                    meta_raw, pcm = msg_parts
-                    far_end_pcm = None
-                elif len(msg_parts) == 3:
-                    meta_raw, pcm, far_end_pcm = msg_parts
-                else:
-                    log_event(log, "invalid_msg_parts", parts=len(msg_parts))
+                # While events are buffered, wait for input only until the next one comes due; otherwise
+                # an idle stream would hold its last updates until the next chunk arrived.
+                wait_sec = event_queue_mgr.seconds_until_ready()
+                if wait_sec is not None and not pull_sock.poll(int(wait_sec * 1000) + 1):
+                    event_queue_mgr.try_publish_ready_events()
                     continue
+                # Block for the next message, then drain whatever backlog is already queued.
+                # copy=False hands back frames so PCM is read in place instead of copied into bytes.
+                batch = [pull_sock.recv_multipart(copy=False)]
+                while len(batch) < ASR_MAX_BATCH:
+                    try:
+                        batch.append(pull_sock.recv_multipart(zmq.NOBLOCK, copy=False))
+                    except zmq.Again:
+                        break
             except Exception as e:
                 log_event(log, "pull_recv_error", error=str(e))
                 time.sleep(0.02)
                 continue
 
-            try:
-                meta = json.loads(meta_raw.decode('utf-8'))
-            except Exception as e:
-                log_event(log, "meta_decode_error", error=str(e))
-                continue
-
-            peer_ip = meta.get('peer_ip', 'unknown')
-            source = meta.get('source', 'unknown')
-            start_ts = meta.get('start_ts')
-            end_ts = meta.get('end_ts')
-            unique_key = meta.get('unique_key')
-            ssrc = meta.get('ssrc')
-            is_finished = bool(meta.get('IsFinished', False))
-
-            # Whitelist filtering: if allow_list exists and is non-empty, only process whitelisted IPs
-            if allow_ips is not None and peer_ip not in allow_ips:
-                log_event(log, "ip_not_allowed", peer_ip=peer_ip, source=source, unique_key=unique_key, ssrc=ssrc)
-                continue
+            chunks = []
+            for msg_parts in batch:
+                chunk = _parse_message(msg_parts, allow_ips)
+                if chunk is not None:
+                    chunks.append(chunk)
 
-            key = (peer_ip, source, unique_key, ssrc)
-            if key not in call_state:
-                call_state[key] = {"chunks": 0, "bytes": 0, "last_text": None}
-
-            st = call_state[key]
-            if pcm:
-                st["chunks"] += 1
-                st["bytes"] += len(pcm)
-                # Pass far_end_pcm to ASR for AEC processing
-                asr_result = _asr_generate_blocking(pcm, far_end_pcm)
-                if asr_result:
-                    txt = asr_result['text']
-                    vad_start_ms = asr_result['vad_start_ms']
-                    st["last_text"] = txt
-
-                    # Calculate voice_start_ts based on chunk_start_ts + VAD offset
-                    chunk_start_ts = start_ts if start_ts is not None else 0
-                    voice_start_ts = chunk_start_ts + (vad_start_ms / 1000.0)
-
-                    # Build event with new timestamp fields
-                    event = {
-                        'type': 'asr_update',
-                        'text': txt,
-                        'peer_ip': peer_ip,
-                        'source': source,
-                        'unique_key': unique_key,
-                        'ssrc': ssrc,
-                        'is_finished': is_finished,
-                        # New timestamp fields
-                        'voice_start_ts': voice_start_ts,  # Actual voice start time
-                        'chunk_start_ts': chunk_start_ts,  # Original chunk start time
-                        'offset_ms': vad_start_ms,  # VAD offset from chunk start
-                    }
-                    log_event(
-                        log,
-                        'asr_update_generated',
-                        text=event['text'],
-                        peer_ip=peer_ip,
-                        source=source,
-                        unique_key=unique_key,
-                        ssrc=ssrc,
-                        is_finished=is_finished,
-                        voice_start_ts=voice_start_ts,
-                        vad_offset_ms=vad_start_ms,
-                    )
-
-                    # Add to priority queue instead of direct publish
-                    event_queue_mgr.add_event(event, voice_start_ts)
-
-                    # Try to publish ready events
-                    event_queue_mgr.try_publish_ready_events()
+            for chunk in _merge_backlog(chunks):
+                _handle_chunk(chunk, call_state, event_queue_mgr, pub_sock)
 
-            if is_finished:
-                # Flush all pending events for this peer before sending call_finished
-                log_event(log, 'flushing_pending_events', peer_ip=peer_ip, source=source)
-                event_queue_mgr.flush_peer(peer_ip)
-
-                finish_evt = {
-                    'type': 'call_finished',
-                    'text': '',
-                    'peer_ip': peer_ip,
-                    'source': source,
-                    'unique_key': unique_key,
-                    'ssrc': ssrc,
-                    'is_finished': True,
-                }
-                log_event(
-                    log,
-                    'call_finished_generated',
-                    peer_ip=peer_ip,
-                    source=source,
-                    unique_key=unique_key,
-                    ssrc=ssrc,
-                    is_finished=is_finished,
-                )
-                try:
-                    pub_sock.send_json(finish_evt, ensure_ascii=False)
-                except Exception as e:
-                    log_event(log, 'pub_send_error', error=str(e))
-                st['chunks'] = 0
-                st['bytes'] = 0
-                st['last_text'] = None
+            # Chunks that yield no text (gated or empty ASR) never reach the publish in _handle_chunk,
+            # so release anything whose buffer window has passed on every iteration.
+            event_queue_mgr.try_publish_ready_events()
 
     except KeyboardInterrupt:
         log_event(log, "daemon_interrupt")
@@ -0,0 +1,43 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson  # optional: C parser, accepts bytes without a decode step
+except Exception:
+    orjson = None
+
+# orjson.JSONDecodeError and json.JSONDecodeError are both ValueError subclasses
+JSONDecodeError = ValueError
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Parse JSON from bytes or str, using orjson when it is installed."""
+
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """Serialize to a compact JSON str (non-ASCII kept as-is), using orjson when it is installed."""
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            # orjson rejects some types stdlib json accepts (e.g. numpy.float64); keep stdlib behaviour
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumpb(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes, ready for a ZMQ frame without a str round-trip."""
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -1,10 +1,13 @@
 import os
-import json
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from datetime import datetime, timedelta
 from typing import Optional, TextIO
 
+from . import json_utils
+
 DEFAULT_LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
 DEFAULT_SUFFIX_FORMAT = "%y-%m-%d-%H-%M"
 
@@ -223,16 +226,46 @@ def configure_rotating_logger(
     return handler
 
 
+def enable_queue_logging(logger: logging.Logger) -> QueueListener:
+    """Move the logger's handlers behind a queue so file/console writes happen on a background thread."""
+
+    handlers = list(logger.handlers)
+    # Unbounded: QueueHandler reports a full queue through handleError for every dropped record
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Drain whatever is still queued on interpreter shutdown
+    atexit.register(listener.stop)
+    return listener
+
+
+def utc_ts() -> str:
+    """Return the current UTC time in the ISO format used by structured events."""
+
+    return datetime.utcnow().isoformat() + "Z"
+
+
 def log_event(
     logger: logging.Logger,
     event: str,
     level: int = logging.INFO,
     *,
     exc_info=None,
+    ts: Optional[str] = None,
     **fields,
 ) -> None:
-    """Log a structured event payload as JSON."""
+    """Log a structured event payload as JSON.
+
+    Pass ``ts`` (see :func:`utc_ts`) to share one timestamp across a burst of related events.
+    """
+
+    # Skip the timestamp and JSON encoding entirely when the record would be dropped
+    if not logger.isEnabledFor(level):
+        return
 
-    payload = {"evt": event, "ts": datetime.utcnow().isoformat() + "Z", **fields}
-    message = json.dumps(payload, ensure_ascii=False)
+    payload = {"evt": event, "ts": ts or utc_ts(), **fields}
+    message = json_utils.dumps(payload)
     logger.log(level, message, exc_info=exc_info)
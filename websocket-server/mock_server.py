@@ -1,12 +1,14 @@
 import os
 import sys
-import json
+import time
+import random
+import secrets
 import asyncio
 import logging
 from datetime import datetime
-from typing import Dict, Optional, Set, Tuple, List
+from typing import Dict, Optional, Tuple, List
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Literal
@@ -17,6 +19,7 @@ if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
 
 from common.logging_utils import log_event
+from common import json_utils
 
 """
 Mock WebSocket Server
@@ -88,6 +91,9 @@ CLIENT_IP_MAPPING: Dict[str, str] = {}
 
 MOCK_TASK: Optional[asyncio.Task] = None
 
+# 通话结束时依次发送 is_finished 的两个 source（模块级常量，避免每次结束都重建）
+FINISH_SOURCES: Tuple[str, ...] = ('citizen', 'hot-line')
+
 # Mock session tracking
 MOCK_UNIQUE_KEY: Optional[str] = None
 MOCK_SSRC_COUNTER: int = 10000  # Mock SSRC starting value
@@ -116,48 +122,55 @@ async def _send_finish_messages():
     
     global MOCK_SSRC_COUNTER
     # 准备两个 source 的 finish 消息
-    sources = ['citizen', 'hot-line']
-    log_event(log, 'mock_finish_start', sources=sources, client_count=len(LISTENING_CLIENTS))
+    log_event(log, 'mock_finish_start', sources=FINISH_SOURCES, client_count=len(LISTENING_CLIENTS))
     
-    for source in sources:
+    finish_evt_templates = []
+    for source in FINISH_SOURCES:
         log_event(log, 'mock_finish_preparing', source=source, ssrc=MOCK_SSRC_COUNTER)
-        finish_evt_template = {
+        finish_evt_templates.append({
             'type': 'asr_update',
             'text': f'[{source} finished]',
             'source': source,
             'is_finished': True,
             'unique_key': MOCK_UNIQUE_KEY or 'mock_session',
             'ssrc': MOCK_SSRC_COUNTER
-        }
+        })
         MOCK_SSRC_COUNTER += 1
-        
-        if EVENT_BROADCAST:
-            # 广播模式：发送给所有客户端
-            tasks: List[asyncio.Task] = []
-            for cid, ws in list(LISTENING_CLIENTS.items()):
-                peer_ip = CLIENT_IP_MAPPING.get(cid, 'unknown')
-                evt = {**finish_evt_template, 'peer_ip': peer_ip}
-                log_event(log, 'mock_finish_broadcast', client_id=cid, peer_ip=peer_ip, source=source)
-                tasks.append(asyncio.create_task(ws.send_text(json.dumps(evt, ensure_ascii=False))))
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-        else:
-            # 单播模式：随机选择一个客户端
-            import random
-            cid, ws = random.choice(list(LISTENING_CLIENTS.items()))
+
+    # 同一 peer_ip 的客户端共用一次序列化结果
+    payloads_by_ip: Dict[str, List[str]] = {}
+
+    async def _send_all(cid: str, ws: WebSocket, peer_ip: str, evt_name: str):
+        payloads = payloads_by_ip.get(peer_ip)
+        if payloads is None:
+            payloads = [json_utils.dumps({**template, 'peer_ip': peer_ip}) for template in finish_evt_templates]
+            payloads_by_ip[peer_ip] = payloads
+        # 同一连接内按 source 顺序发送，不同连接之间并发
+        for template, payload in zip(finish_evt_templates, payloads):
+            log_event(log, evt_name, client_id=cid, peer_ip=peer_ip, source=template['source'])
+            await ws.send_text(payload)
+
+    if EVENT_BROADCAST:
+        # 广播模式：所有客户端一次 gather 并发发送双端结束事件
+        tasks: List[asyncio.Task] = []
+        for cid, ws in list(LISTENING_CLIENTS.items()):
             peer_ip = CLIENT_IP_MAPPING.get(cid, 'unknown')
-            evt = {**finish_evt_template, 'peer_ip': peer_ip}
-            log_event(log, 'mock_finish_unicast', client_id=cid, peer_ip=peer_ip, source=source)
-            try:
-                await ws.send_text(json.dumps(evt, ensure_ascii=False))
-            except Exception as e:
-                log_event(log, 'mock_finish_unicast_error', client_id=cid, source=source, error=str(e))
-        
+            tasks.append(asyncio.create_task(_send_all(cid, ws, peer_ip, 'mock_finish_broadcast')))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    else:
+        # 单播模式：随机选择一个客户端
+        cid, ws = random.choice(list(LISTENING_CLIENTS.items()))
+        peer_ip = CLIENT_IP_MAPPING.get(cid, 'unknown')
+        try:
+            await _send_all(cid, ws, peer_ip, 'mock_finish_unicast')
+        except Exception as e:
+            log_event(log, 'mock_finish_unicast_error', client_id=cid, error=str(e))
+
+    for source in FINISH_SOURCES:
         log_event(log, 'mock_finish_sent', source=source)
-        # 连续快速发送双端结束事件，不需要间隔
-        # await asyncio.sleep(2.0)  # 已移除延迟
     
-    log_event(log, 'mock_finish_complete', sources_sent=len(sources))
+    log_event(log, 'mock_finish_complete', sources_sent=len(FINISH_SOURCES))
 
 
 async def _mock_event_loop():
@@ -167,15 +180,23 @@ async def _mock_event_loop():
     global MOCK_UNIQUE_KEY, MOCK_SSRC_COUNTER
     
     # Initialize mock session
-    import uuid
-    MOCK_UNIQUE_KEY = f"mock_{uuid.uuid4().hex[:12]}"
+    MOCK_UNIQUE_KEY = f"mock_{secrets.token_hex(6)}"
     MOCK_SSRC_COUNTER = 10000
     
     log_event(log, 'mock_loop_start', interval=EVENT_INTERVAL, broadcast=EVENT_BROADCAST, 
               cycles_per_call=CYCLES_PER_CALL, unique_key=MOCK_UNIQUE_KEY)
+    # 按绝对截止时间（事件循环单调时钟）调度，发送耗时不会累积成漂移
+    loop = asyncio.get_running_loop()
+    next_deadline = loop.time()
     try:
         while True:
-            await asyncio.sleep(EVENT_INTERVAL)
+            next_deadline += EVENT_INTERVAL
+            delay = next_deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # 已落后（发送阻塞过久）：从当前时刻重新计时，不做补发
+                next_deadline = loop.time()
             if not LISTENING_CLIENTS:
                 continue
             text = EVENT_TEXTS[idx % len(EVENT_TEXTS)]
@@ -196,22 +217,25 @@ async def _mock_event_loop():
             if EVENT_BROADCAST:
                 # 广播：复制并针对每个 client IP 设置 peer_ip
                 tasks: List[asyncio.Task] = []
+                payload_by_ip: Dict[str, str] = {}
                 for cid, ws in list(LISTENING_CLIENTS.items()):
                     peer_ip = CLIENT_IP_MAPPING.get(cid, 'unknown')
-                    evt = {**base_evt, 'peer_ip': peer_ip}
+                    payload = payload_by_ip.get(peer_ip)
+                    if payload is None:
+                        payload = json_utils.dumps({**base_evt, 'peer_ip': peer_ip})
+                        payload_by_ip[peer_ip] = payload
                     log_event(log, 'mock_evt_broadcast', client_id=cid, peer_ip=peer_ip)
-                    tasks.append(asyncio.create_task(ws.send_text(json.dumps(evt, ensure_ascii=False))))
+                    tasks.append(asyncio.create_task(ws.send_text(payload)))
                 if tasks:
                     await asyncio.gather(*tasks, return_exceptions=True)
             else:
                 # 非广播：随机挑一个 client 发送
-                import random
                 cid, ws = random.choice(list(LISTENING_CLIENTS.items()))
                 peer_ip = CLIENT_IP_MAPPING.get(cid, 'unknown')
                 evt = {**base_evt, 'peer_ip': peer_ip}
                 log_event(log, 'mock_evt_unicast', client_id=cid, peer_ip=peer_ip)
                 try:
-                    await ws.send_text(json.dumps(evt, ensure_ascii=False))
+                    await ws.send_text(json_utils.dumps(evt))
                 except Exception as e:
                     log_event(log, 'mock_unicast_error', client_id=cid, error=str(e))
 
@@ -224,12 +248,12 @@ async def _mock_event_loop():
                     await _send_finish_messages()
                     # reset for next call and generate new session
                     cycle_count = 0
-                    import uuid
-                    MOCK_UNIQUE_KEY = f"mock_{uuid.uuid4().hex[:12]}"
+                    MOCK_UNIQUE_KEY = f"mock_{secrets.token_hex(6)}"
                     MOCK_SSRC_COUNTER = 10000
                     # 发完 is_finished 消息后等待 60 秒（1 分钟）再开始下一轮
                     log_event(log, 'mock_waiting_next_round', wait_seconds=60, new_unique_key=MOCK_UNIQUE_KEY)
                     await asyncio.sleep(60)
+                    next_deadline = loop.time()
     except asyncio.CancelledError:
         log_event(log, 'mock_loop_cancel')
     finally:
@@ -272,53 +296,48 @@ async def health():
 @app.websocket("/listening")
 async def websocket_listening_endpoint(websocket: WebSocket):
     await websocket.accept()
-    import uuid
-    client_id = uuid.uuid4().hex[:8]
+    client_id = secrets.token_hex(4)
     client_ip = _client_ip_from_ws(websocket)
 
     LISTENING_CLIENTS[client_id] = websocket
     CLIENT_IP_MAPPING[client_id] = client_ip
     log_event(log, 'client_connect', client_id=client_id, client_ip=client_ip, total_clients=len(LISTENING_CLIENTS))
 
-    last_activity = datetime.utcnow()
+    # Monotonic seconds: only used for the idle interval, never shown to clients
+    last_activity = time.monotonic()
 
     async def server_heartbeat():
         while True:
             try:
-                await websocket.send_text(json.dumps({'type': 'server_heartbeat', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(json_utils.dumps({'type': 'server_heartbeat', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                # 空闲检测随心跳进行（仅记录日志，不强制断开）；空闲时长只计算一次
+                idle_sec = time.monotonic() - last_activity
+                if idle_sec > CLIENT_IDLE_TIMEOUT:
+                    log_event(log, 'client_idle', client_id=client_id, idle_sec=idle_sec)
                 await asyncio.sleep(HEARTBEAT_SEC)
             except Exception:
                 break
     hb_task = asyncio.create_task(server_heartbeat())
 
     try:
-        while True:
-            try:
-                msg = await asyncio.wait_for(websocket.receive_text(), timeout=2.0)
-                last_activity = datetime.utcnow()
-            except asyncio.TimeoutError:
-                # 空闲检测（仅记录日志，不强制断开）
-                if (datetime.utcnow() - last_activity).total_seconds() > CLIENT_IDLE_TIMEOUT:
-                    log_event(log, 'client_idle', client_id=client_id, idle_sec=(datetime.utcnow() - last_activity).total_seconds())
-                continue
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                log_event(log, 'client_recv_error', client_id=client_id, error=str(e))
-                break
+        # Same receive loop as websocket.py: iter_text() ends on disconnect, so there is no timeout task per wait
+        async for msg in websocket.iter_text():
+            last_activity = time.monotonic()
             try:
-                data = json.loads(msg)
+                data = json_utils.loads(msg)
             except Exception:
                 continue
             msg_type = data.get('type')
             if msg_type == 'ping':
-                await websocket.send_text(json.dumps({'type': 'pong', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(json_utils.dumps({'type': 'pong', 'ts': datetime.utcnow().isoformat() + 'Z'}))
                 log_event(log, 'client_ping', client_id=client_id)
             elif msg_type == 'stop_listening':
-                await websocket.send_text(json.dumps({'type': 'stopped', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(json_utils.dumps({'type': 'stopped', 'ts': datetime.utcnow().isoformat() + 'Z'}))
                 break
             else:
                 log_event(log, 'client_msg_unknown', client_id=client_id, raw=msg_type)
+    except Exception as e:
+        log_event(log, 'client_recv_error', client_id=client_id, error=str(e))
     finally:
         hb_task.cancel()
         LISTENING_CLIENTS.pop(client_id, None)
@@ -1,13 +1,14 @@
 import os
 import sys
-import json
+import time
+import secrets
 import asyncio
 import logging
 from datetime import datetime
-from typing import Dict, Optional, Set, Tuple, List
+from typing import Dict, Optional, Tuple, List
 
 import zmq.asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,7 +19,8 @@ if root_dir not in sys.path:
 if script_dir not in sys.path:
     sys.path.insert(0, script_dir)
 
-from common.logging_utils import NoRTFilter, configure_rotating_logger, log_event
+from common.logging_utils import NoRTFilter, configure_rotating_logger, enable_queue_logging, log_event, utc_ts
+from common import json_utils
 
 
 LOG_NAME = "WSServer"
@@ -50,14 +52,24 @@ stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
 stream_handler.addFilter(NoRTFilter())
 log.addHandler(stream_handler)
+# Per-event file/console writes run on a listener thread instead of the caller
+enable_queue_logging(log)
 # --- End Logging Setup ---
 
 
 # --- Configuration ---
 ASR_EVENTS_ENDPOINT = os.getenv("ASR_EVENTS_ENDPOINT", "tcp://0.0.0.0:5557")
+# SUB binds by default (daemon PUB connects). Set to 0 to connect instead, against a daemon running
+# with OUTPUT_ZMQ_BIND=1; required for WS_WORKERS > 1 since only one process can bind the port.
+ASR_EVENTS_BIND = os.getenv("ASR_EVENTS_BIND", "1").strip().lower() in {"1", "true", "yes", "on"}
+# SUB receive queue bounds: events beyond RCVHWM are dropped by ZMQ; RCVBUF <= 0 keeps the OS default
+ASR_EVENTS_RCVHWM = max(0, int(os.getenv("ASR_EVENTS_RCVHWM", "1000")))
+ASR_EVENTS_RCVBUF = int(os.getenv("ASR_EVENTS_RCVBUF", "0"))
 WS_BROADCAST_ALL = os.getenv("WS_BROADCAST_ALL", "0").strip().lower() in {"1", "true", "yes", "on"}
 WS_ALLOWED_ORIGINS_RAW = os.getenv("WS_ALLOWED_ORIGINS", "*")
 WS_ALLOWED_ORIGINS = [origin.strip() for origin in WS_ALLOWED_ORIGINS_RAW.split(",") if origin.strip()] or ["*"]
+# Per-client outbound queue depth; a client that falls this far behind loses its oldest pending events
+WS_SEND_QUEUE_SIZE = max(1, int(os.getenv("WS_SEND_QUEUE_SIZE", "64")))
 
 
 # --- FastAPI App Setup ---
@@ -76,11 +88,77 @@ app.add_middleware(
 # --- Runtime State ---
 LISTENING_CLIENTS: Dict[str, WebSocket] = {}
 CLIENT_IP_MAPPING: Dict[str, Optional[str]] = {}
+# ip -> {client_id: websocket}; lets targeted routing skip the scan over every client
+CLIENTS_BY_IP: Dict[Optional[str], Dict[str, WebSocket]] = {}
+# client_id -> outbound payload queue drained by that client's writer task
+CLIENT_OUTBOX: Dict[str, "asyncio.Queue[str]"] = {}
 ZMQ_TASK: Optional[asyncio.Task] = None
 # Cache for broadcast mode to lock onto a single peer IP until stream ends
 BROADCAST_ACTIVE_PEER_IP: Optional[str] = None
 
 
+def _register_client(
+    client_id: str,
+    websocket: WebSocket,
+    client_ip: Optional[str],
+    outbox: "asyncio.Queue[str]",
+) -> None:
+    LISTENING_CLIENTS[client_id] = websocket
+    CLIENT_OUTBOX[client_id] = outbox
+    CLIENT_IP_MAPPING[client_id] = client_ip
+    CLIENTS_BY_IP.setdefault(client_ip, {})[client_id] = websocket
+
+
+def _unregister_client(client_id: str) -> None:
+    LISTENING_CLIENTS.pop(client_id, None)
+    CLIENT_OUTBOX.pop(client_id, None)
+    client_ip = CLIENT_IP_MAPPING.pop(client_id, None)
+    by_ip = CLIENTS_BY_IP.get(client_ip)
+    if by_ip is not None:
+        by_ip.pop(client_id, None)
+        if not by_ip:
+            del CLIENTS_BY_IP[client_ip]
+
+
+def _enqueue_send(client_id: str, payload: str) -> None:
+    """Queue a payload for the client's writer task without waiting on the socket."""
+    outbox = CLIENT_OUTBOX.get(client_id)
+    if outbox is None:
+        return
+    if outbox.full():
+        # Slow client: drop its oldest pending event rather than stall the ZMQ consumer
+        outbox.get_nowait()
+        log_event(log, 'client_send_queue_full', level=logging.WARNING, client_id=client_id, maxsize=outbox.maxsize)
+    outbox.put_nowait(payload)
+
+
+async def _client_writer(client_id: str, websocket: WebSocket, outbox: "asyncio.Queue[str]"):
+    """Send queued payloads to one client; on failure drop the client like the old inline sends did."""
+    while True:
+        payload = await outbox.get()
+        try:
+            await websocket.send_text(payload)
+        except Exception as e:
+            log_event(log, 'client_send_error', client_id=client_id, error=str(e))
+            _unregister_client(client_id)
+            log_event(log, 'client_removed_send_fail', client_id=client_id)
+            return
+
+
+# (epoch second, serialized server_heartbeat) shared by every client's heartbeat within that second
+_heartbeat_cache: Tuple[int, str] = (-1, '')
+
+
+def _heartbeat_payload() -> str:
+    """Return the server_heartbeat frame, re-formatting the timestamp at most once per second."""
+    global _heartbeat_cache
+    now_sec = int(time.time())
+    if _heartbeat_cache[0] != now_sec:
+        ts = datetime.utcfromtimestamp(now_sec).isoformat() + 'Z'
+        _heartbeat_cache = (now_sec, json_utils.dumps({'type': 'server_heartbeat', 'ts': ts}))
+    return _heartbeat_cache[1]
+
+
 def _client_ip_from_ws(websocket: WebSocket) -> str:
     try:
         headers = {k.lower(): v for k, v in websocket.headers.items()}
@@ -99,49 +177,39 @@ async def _zmq_consume_loop():
     ctx = zmq.asyncio.Context.instance()
     sub = ctx.socket(zmq.SUB)
     sub.setsockopt(zmq.LINGER, 0)
+    # Bound how much backlog can pile up in the SUB queue if dispatch falls behind (must precede bind/connect)
+    sub.setsockopt(zmq.RCVHWM, ASR_EVENTS_RCVHWM)
+    if ASR_EVENTS_RCVBUF > 0:
+        sub.setsockopt(zmq.RCVBUF, ASR_EVENTS_RCVBUF)
     sub.setsockopt(zmq.SUBSCRIBE, b"")  # subscribe all
-    sub.bind(ASR_EVENTS_ENDPOINT)
-    log_event(log, 'zmq_sub_connected', endpoint=ASR_EVENTS_ENDPOINT)
+    if ASR_EVENTS_BIND:
+        sub.bind(ASR_EVENTS_ENDPOINT)
+    else:
+        sub.connect(ASR_EVENTS_ENDPOINT)
+    log_event(log, 'zmq_sub_connected', endpoint=ASR_EVENTS_ENDPOINT, mode='bind' if ASR_EVENTS_BIND else 'connect', pid=os.getpid(), rcvhwm=ASR_EVENTS_RCVHWM)
     log_event(log, 'zmq_consume_loop_start', endpoint=ASR_EVENTS_ENDPOINT)
 
     try:
         while True:
             msg = await sub.recv()
+            # One timestamp for every log line this event produces
+            evt_ts = utc_ts()
+            # Raw wire view of every message; DEBUG only, so the preview decode is skipped in normal runs
+            if log.isEnabledFor(logging.DEBUG):
+                log_event(log, 'zmq_raw_msg_received', level=logging.DEBUG, ts=evt_ts, bytes=len(msg), preview=msg[:200].decode('utf-8', errors='replace'))
+            # Parse once; the JSON is decoded here and nowhere else
             try:
-                if isinstance(msg, (bytes, bytearray)):
-                    raw_len = len(msg)
-                    raw_preview = msg[:200].decode('utf-8', errors='replace')
-                    text_preview = None
-                    # Try extract "text" field for more human readable log (unescaped)
-                    try:
-                        tmp_obj = json.loads(raw_preview)
-                        if isinstance(tmp_obj, dict) and 'text' in tmp_obj:
-                            # limit text preview length to 120 chars for safety
-                            text_preview = str(tmp_obj.get('text'))[:120]
-                    except Exception:
-                        pass
-                    if text_preview is not None:
-                        log_event(log, 'zmq_raw_msg_received', bytes=raw_len, preview=raw_preview, text_preview=text_preview)
-                    else:
-                        log_event(log, 'zmq_raw_msg_received', bytes=raw_len, preview=raw_preview)
-                else:
-                    log_event(log, 'zmq_raw_msg_received', type=str(type(msg)))
-            except Exception as e:
-                log_event(log, 'zmq_raw_log_error', error=str(e))
-            try:
-                evt = json.loads(msg.decode('utf-8')) if isinstance(msg, (bytes, bytearray)) else msg
+                evt = json_utils.loads(msg)
             except Exception:
-                # sub may deliver JSON via send_json (already parsed) in some contexts
-                if isinstance(msg, dict):
-                    evt = msg
-                else:
-                    try:
-                        # log decode failure with preview
-                        preview = msg[:200].decode('utf-8', errors='replace') if isinstance(msg, (bytes, bytearray)) else str(msg)[:200]
-                        log_event(log, 'zmq_json_decode_error', preview=preview)
-                    except Exception:
-                        log_event(log, 'zmq_json_decode_error')
-                    continue
+                try:
+                    preview = msg[:200].decode('utf-8', errors='replace')
+                    log_event(log, 'zmq_json_decode_error', ts=evt_ts, bytes=len(msg), preview=preview)
+                except Exception:
+                    log_event(log, 'zmq_json_decode_error', ts=evt_ts)
+                continue
+            if not isinstance(evt, dict):
+                log_event(log, 'zmq_evt_not_object', ts=evt_ts, bytes=len(msg), evt_type=type(evt).__name__)
+                continue
 
             try:
                 evt_text_preview = None
@@ -152,6 +220,8 @@ async def _zmq_consume_loop():
                 log_event(
                     log,
                     'zmq_evt_parsed',
+                    ts=evt_ts,
+                    bytes=len(msg),
                     evt_type=evt.get('type'),
                     peer_ip=evt.get('peer_ip'),
                     source=evt.get('source'),
@@ -163,7 +233,7 @@ async def _zmq_consume_loop():
             except Exception:
                 pass
 
-            await _dispatch_asr_event(evt)
+            await _dispatch_asr_event(evt, ts=evt_ts)
     except asyncio.CancelledError:
         log_event(log, 'zmq_consume_cancel')
     finally:
@@ -175,8 +245,10 @@ async def _zmq_consume_loop():
         log_event(log, 'zmq_consume_exit')
 
 
-async def _dispatch_asr_event(evt: Dict):
+async def _dispatch_asr_event(evt: Dict, ts: Optional[str] = None):
     # Expect schema from daemon: {type, text, peer_ip, source, unique_key, ssrc}
+    # `ts` is shared by all log lines of the fan-out so N recipients do not cost N clock reads
+    ts = ts or utc_ts()
     if not isinstance(evt, dict):
         return
     if 'type' not in evt:
@@ -189,14 +261,19 @@ async def _dispatch_asr_event(evt: Dict):
     ssrc = evt.get('ssrc')
     peer_ip = evt.get('peer_ip')
     is_finished = bool(evt.get('is_finished'))
-    text_preview = None
-    if 'text' in evt and evt.get('text') is not None:
-        try:
-            text_preview = str(evt.get('text'))[:120]
-        except Exception:
-            text_preview = '<unserializable>'
+    # Fast path: the daemon always sends text as str; anything else goes through str()
+    text_preview = evt.get('text')
+    if text_preview is not None:
+        if isinstance(text_preview, str):
+            text_preview = text_preview[:120]
+        else:
+            try:
+                text_preview = str(text_preview)[:120]
+            except Exception:
+                text_preview = '<unserializable>'
 
-    clients_snapshot: List[Tuple[str, WebSocket]] = list(LISTENING_CLIENTS.items())
+    # Serialize once per event; every recipient gets the same payload
+    payload = json_utils.dumps(evt)
 
     global BROADCAST_ACTIVE_PEER_IP
     if WS_BROADCAST_ALL:
@@ -206,6 +283,7 @@ async def _dispatch_asr_event(evt: Dict):
             log_event(
                 log,
                 'broadcast_target_acquired',
+                ts=ts,
                 peer_ip=BROADCAST_ACTIVE_PEER_IP,
                 unique_key=unique_key,
                 ssrc=ssrc,
@@ -214,6 +292,7 @@ async def _dispatch_asr_event(evt: Dict):
             log_event(
                 log,
                 'broadcast_skip_peer_mismatch',
+                ts=ts,
                 peer_ip=event_peer_ip,
                 active_peer=BROADCAST_ACTIVE_PEER_IP,
                 unique_key=unique_key,
@@ -221,75 +300,46 @@ async def _dispatch_asr_event(evt: Dict):
             )
             return
         # Broadcast to all connected clients
+        clients_snapshot: List[Tuple[str, WebSocket]] = list(LISTENING_CLIENTS.items())
         if not clients_snapshot:
-            log_event(log, 'broadcast_no_clients', total_clients=0)
+            log_event(log, 'broadcast_no_clients', ts=ts, total_clients=0)
             return
         log_event(
             log,
             'broadcast_event',
+            ts=ts,
             total_clients=len(clients_snapshot),
             evt_type=evt.get('type'),
             unique_key=unique_key,
             ssrc=ssrc,
             text=text_preview,
         )
-        tasks: List[asyncio.Task] = []
-        for cid, ws in clients_snapshot:
-            tasks.append(asyncio.create_task(ws.send_text(json.dumps(evt, ensure_ascii=False))))
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            problem: Set[str] = set()
-            for idx, res in enumerate(results):
-                if isinstance(res, Exception) and idx < len(clients_snapshot):
-                    cid = clients_snapshot[idx][0]
-                    problem.add(cid)
-                    log_event(
-                        log,
-                        'broadcast_client_send_error',
-                        client_id=cid,
-                        error=str(res),
-                        unique_key=unique_key,
-                        ssrc=ssrc,
-                        text=text_preview,
-                    )
-            for pc in problem:
-                LISTENING_CLIENTS.pop(pc, None)
-                CLIENT_IP_MAPPING.pop(pc, None)
-                log_event(
-                    log,
-                    'client_removed_send_fail',
-                    client_id=pc,
-                    reason='broadcast_send_fail',
-                    unique_key=unique_key,
-                    ssrc=ssrc,
-                        text=text_preview,
-                )
+        for cid, _ws in clients_snapshot:
+            _enqueue_send(cid, payload)
         return
 
     # --- Original targeted routing by peer_ip ---
     target_ip = peer_ip if peer_ip else 'unknown'
-    target_clients: List[Tuple[str, WebSocket]] = []
-    for cid, ws in clients_snapshot:
-        if CLIENT_IP_MAPPING.get(cid) == target_ip:
-            target_clients.append((cid, ws))
+    target_clients: List[Tuple[str, WebSocket]] = list(CLIENTS_BY_IP.get(target_ip, {}).items())
 
-    tasks: List[asyncio.Task] = []
-    for cid, ws in target_clients:
+    for cid, _ws in target_clients:
         log_event(
             log,
             'send_data_to_client',
+            ts=ts,
             client_id=cid,
             target_ip=target_ip,
             unique_key=unique_key,
             ssrc=ssrc,
             text=text_preview,
         )
-        tasks.append(asyncio.create_task(ws.send_text(json.dumps(evt, ensure_ascii=False))))
+        _enqueue_send(cid, payload)
 
     if not target_clients:
         log_event(
             log,
             'no_target_clients_found',
+            ts=ts,
             target_ip=target_ip,
             total_clients=len(LISTENING_CLIENTS),
             unique_key=unique_key,
@@ -297,34 +347,6 @@ async def _dispatch_asr_event(evt: Dict):
             text=text_preview,
         )
 
-    if tasks:
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        problem_clients: Set[str] = set()
-        for idx, res in enumerate(results):
-            if isinstance(res, Exception) and idx < len(target_clients):
-                cid = target_clients[idx][0]
-                problem_clients.add(cid)
-                log_event(
-                    log,
-                    'client_send_error',
-                    client_id=cid,
-                    error=str(res),
-                    unique_key=unique_key,
-                    ssrc=ssrc,
-                    text=text_preview,
-                )
-        for pc in problem_clients:
-            LISTENING_CLIENTS.pop(pc, None)
-            CLIENT_IP_MAPPING.pop(pc, None)
-            log_event(
-                log,
-                'client_removed_send_fail',
-                client_id=pc,
-                unique_key=unique_key,
-                ssrc=ssrc,
-                text=text_preview,
-            )
-
 
 @app.on_event("startup")
 async def startup_event():
@@ -368,49 +390,44 @@ except Exception as e:
 @app.websocket("/listening")
 async def websocket_listening_endpoint(websocket: WebSocket):
     await websocket.accept()
-    import uuid
-    client_id = uuid.uuid4().hex[:8]
+    # 8 hex chars like before, without building a UUID object per connection
+    client_id = secrets.token_hex(4)
     client_ip = _client_ip_from_ws(websocket)
 
-    LISTENING_CLIENTS[client_id] = websocket
-    CLIENT_IP_MAPPING[client_id] = client_ip
+    outbox: "asyncio.Queue[str]" = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+    _register_client(client_id, websocket, client_ip, outbox)
+    writer_task = asyncio.create_task(_client_writer(client_id, websocket, outbox))
     log_event(log, 'client_connect', client_id=client_id, client_ip=client_ip, total_clients=len(LISTENING_CLIENTS))
 
     async def server_heartbeat():
         while True:
             try:
-                await websocket.send_text(json.dumps({'type': 'server_heartbeat', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(_heartbeat_payload())
                 await asyncio.sleep(1.0)
             except Exception:
                 break
     hb_task = asyncio.create_task(server_heartbeat())
 
     try:
-        while True:
-            try:
-                # keep the socket alive; we only care about ping/pong
-                msg = await asyncio.wait_for(websocket.receive_text(), timeout=2.0)
-            except asyncio.TimeoutError:
-                continue
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                log_event(log, 'client_recv_error', client_id=client_id, error=str(e))
-                break
+        # keep the socket alive; we only care about ping/pong. iter_text() simply ends on disconnect,
+        # so there is no timeout task per wait and no WebSocketDisconnect to catch here.
+        async for msg in websocket.iter_text():
             try:
-                data = json.loads(msg)
+                data = json_utils.loads(msg)
             except Exception:
                 continue
             if data.get('type') == 'ping':
-                await websocket.send_text(json.dumps({'type': 'pong', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(json_utils.dumps({'type': 'pong', 'ts': datetime.utcnow().isoformat() + 'Z'}))
                 log_event(log, 'client_ping', client_id=client_id)
             elif data.get('type') == 'stop_listening':
-                await websocket.send_text(json.dumps({'type': 'stopped', 'ts': datetime.utcnow().isoformat() + 'Z'}))
+                await websocket.send_text(json_utils.dumps({'type': 'stopped', 'ts': datetime.utcnow().isoformat() + 'Z'}))
                 break
+    except Exception as e:
+        log_event(log, 'client_recv_error', client_id=client_id, error=str(e))
     finally:
         hb_task.cancel()
-        LISTENING_CLIENTS.pop(client_id, None)
-        CLIENT_IP_MAPPING.pop(client_id, None)
+        writer_task.cancel()
+        _unregister_client(client_id)
     log_event(log, 'client_disconnect', client_id=client_id, client_ip=client_ip, remaining=len(LISTENING_CLIENTS))
 
 
@@ -426,14 +443,30 @@ if __name__ == "__main__":
     # Allow overriding listen port (default 8000) so frontend config can match dynamically.
     PORT = int(os.getenv("WS_SERVER_PORT", "8000"))
     RELOAD_ENABLED = os.getenv("UVICORN_RELOAD", "true").strip().lower() in {"1", "true", "yes", "on"}
+    # Protocol ping/pong (uvicorn's 20s default) is what detects half-open peers: server_heartbeat is one-way
+    # and gets no reply. <= 0 disables it.
+    WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+    ws_ping_interval = WS_PING_INTERVAL if WS_PING_INTERVAL > 0 else None
+    # Each worker runs its own SUB and serves only its own clients, so every worker must see every event
+    WS_WORKERS = max(1, int(os.getenv("WS_WORKERS", "1")))
+    if WS_WORKERS > 1 and (ASR_EVENTS_BIND or RELOAD_ENABLED):
+        log_event(
+            log,
+            'ws_workers_forced_single',
+            requested=WS_WORKERS,
+            reason='reload enabled' if RELOAD_ENABLED else 'ASR_EVENTS_BIND=1 allows a single SUB bind',
+        )
+        WS_WORKERS = 1
 
     try:
-        log_event(log, 'server_starting', port=PORT, host='0.0.0.0', reload=RELOAD_ENABLED)
+        log_event(log, 'server_starting', port=PORT, host='0.0.0.0', reload=RELOAD_ENABLED, ws_ping_interval=ws_ping_interval, workers=WS_WORKERS)
     except Exception:
         pass
 
     module_name = os.path.splitext(os.path.basename(__file__))[0]
     if RELOAD_ENABLED:
-        uvicorn.run(f"{module_name}:app", host="0.0.0.0", port=PORT, reload=True, log_level="info")
+        uvicorn.run(f"{module_name}:app", host="0.0.0.0", port=PORT, reload=True, log_level="info", ws_ping_interval=ws_ping_interval)
+    elif WS_WORKERS > 1:
+        uvicorn.run(f"{module_name}:app", host="0.0.0.0", port=PORT, workers=WS_WORKERS, log_level="info", ws_ping_interval=ws_ping_interval)
     else:
-        uvicorn.run(app, host="0.0.0.0", port=PORT, log_level="info")
+        uvicorn.run(app, host="0.0.0.0", port=PORT, log_level="info", ws_ping_interval=ws_ping_interval)